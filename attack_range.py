@@ -1,17 +1,35 @@
 import os
 import sys
 import argparse
+import importlib
 
 from modules.config_handler import ConfigHandler
-from modules.aws_controller import AwsController
-from modules.azure_controller import AzureController
-from modules import configuration
+from modules import inventory_cache
+
+# controllers by cloud_provider, imported on first use so that only the SDKs of the configured provider are loaded
+CONTROLLERS = {
+    'aws': ('modules.aws_controller', 'AwsController'),
+    'azure': ('modules.azure_controller', 'AzureController'),
+    'local': ('modules.vagrant_controller', 'VagrantController'),
+}
+# config key of the region the inventory cache of a provider is kept for, local ranges are not cached
+INVENTORY_REGIONS = {
+    'aws': 'region',
+    'azure': 'location',
+}
 
 # need to set this ENV var due to a OSX High Sierra forking bug
 # see this discussion for more details: https://github.com/ansible/ansible/issues/34056#issuecomment-352862252
 os.environ['OBJC_DISABLE_INITIALIZE_FORK_SAFETY'] = 'YES'
 
 
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got " + value)
+    return number
+
+
 def init(args):
     config_path = args.config
     print("""                   
@@ -50,34 +68,55 @@ By: Splunk Threat Research Team [STRT] - research@splunk.com
     config = ConfigHandler.read_config(config_path)
     ConfigHandler.validate_config(config)
 
-    if config['general']['cloud_provider'] == 'aws':
-        config.pop('azure')
-        config.pop('local')
-        controller = AwsController(config)
-    elif config['general']['cloud_provider'] == 'azure':
-        config.pop('aws')
-        config.pop('local')
-        controller = AzureController(config)
-    elif config['general']['cloud_provider'] == 'local':
-        from modules.vagrant_controller import VagrantController
-        config.pop('azure')
-        config.pop('aws')
-        controller = VagrantController(config)
+    cloud_provider = config['general']['cloud_provider']
+    if cloud_provider not in CONTROLLERS:
+        print("ERROR: cloud_provider " + cloud_provider + " is not supported")
+        sys.exit(1)
+
+    if args.refresh and cloud_provider in INVENTORY_REGIONS:
+        inventory_cache.clear_inventory(cloud_provider, config[cloud_provider][INVENTORY_REGIONS[cloud_provider]],
+                                        config['general']['key_name'], config['general']['attack_range_name'])
+
+    for provider in CONTROLLERS:
+        if provider != cloud_provider:
+            config.pop(provider)
+
+    module_name, class_name = CONTROLLERS[cloud_provider]
+    controller = getattr(importlib.import_module(module_name), class_name)(config)
     
     return controller
 
 
 def simulate(args):
     controller = init(args)
-    controller.simulate(args.engine, args.target, args.technique, args.playbook)
+    controller.simulate(args.engine, args.target, args.technique, args.playbook, args.host_concurrency)
 
 def dump(args):
     controller = init(args)
-    controller.dump(args.file_name, args.search, args.earliest, args.latest)
+    controller.dump(args.file_name, args.search, args.earliest, args.latest, args.compress, args.slices,
+                    args.checkpoint, args.checkpoint_interval)
 
 def replay(args):
+    if not args.manifest and not (args.file_name and args.source and args.sourcetype):
+        print("ERROR: replay needs --manifest or --file_name, --source and --sourcetype")
+        sys.exit(1)
+    if args.rate and args.speed:
+        print("ERROR: replay takes either --rate or --speed")
+        sys.exit(1)
+    if args.manifest and args.engine == "oneshot":
+        print("ERROR: --manifest replays through the HTTP Event Collector and does not support --engine oneshot")
+        sys.exit(1)
+    engine = args.engine or ("hec" if args.manifest else "oneshot")
+    if (args.rate or args.speed) and engine != "hec":
+        print("ERROR: --rate and --speed need --engine hec")
+        sys.exit(1)
     controller = init(args)
-    controller.replay(args.file_name, args.index, args.sourcetype, args.source)
+    if args.manifest:
+        controller.replay_manifest(args.manifest, args.index, args.update_timestamp, args.batch_size,
+                                   args.concurrency, args.compress, args.parallel_files, args.rate, args.speed)
+        return
+    controller.replay(args.file_name, args.index, args.sourcetype, args.source, args.update_timestamp, args.workers,
+                      engine, args.batch_size, args.concurrency, args.compress, args.rate, args.speed)
 
 def build(args):
     controller = init(args)
@@ -90,18 +129,19 @@ def destroy(args):
 def stop(args):
     controller = init(args)
     instance_ids = [id.strip() for id in args.instance_ids.split(',')] if args.instance_ids else None
-    controller.stop(instance_ids)
+    controller.stop(instance_ids, args.wait)
     
 def resume(args):
     controller = init(args)
     instance_ids = [id.strip() for id in args.instance_ids.split(',')] if args.instance_ids else None
-    controller.resume(instance_ids)
+    controller.resume(instance_ids, args.wait)
 
 def packer(args):
     controller = init(args)
     controller.packer(args.image_name)
 
 def configure(args):
+    from modules import configuration
     configuration.new(args.config)
 
 def show(args):
@@ -132,6 +172,8 @@ def main(args):
         description="Use `attack_range.py action -h` to get help with any Attack Range action")
     parser.add_argument("-c", "--config", required=False, default="attack_range.yml",
                         help="path to the configuration file of the attack range")
+    parser.add_argument("--refresh", required=False, action="store_true",
+                        help="ignore the cached instance IPs of the attack range and look them up again")
     parser.set_defaults(func=lambda _: parser.print_help())
 
     actions_parser = parser.add_subparsers(title="attack Range actions", dest="action")
@@ -157,11 +199,15 @@ def main(args):
 
     # Stop arguments
     stop_parser.set_defaults(func=stop)
-    stop_parser.add_argument("--instance_ids", required=False, type=str, help="comma-separated list of instance IDs to stop")
+    stop_parser.add_argument("--instance_ids", required=False, type=str, help="comma-separated list of instance IDs to stop, machine names on azure and local")
+    stop_parser.add_argument("--wait", required=False, action="store_true",
+                             help="wait until all instances are stopped and report the time each one took")
 
     # Resume arguments
     resume_parser.set_defaults(func=resume)
-    resume_parser.add_argument("--instance_ids", required=False, type=str, help="comma-separated list of instance IDs to resume")
+    resume_parser.add_argument("--instance_ids", required=False, type=str, help="comma-separated list of instance IDs to resume, machine names on azure and local")
+    resume_parser.add_argument("--wait", required=False, action="store_true",
+                               help="wait until all instances are running and pass their status checks, and report the time each one took")
 
     # Packer agruments
     packer_parser.add_argument("-in", "--image_name", required=True, type=str,
@@ -177,12 +223,15 @@ def main(args):
     simulate_parser.add_argument("-e", "--engine", required=False, default="ART",
                                  help="simulation engine to use. Available options are: PurpleSharp and ART (default)")
     simulate_parser.add_argument("-t", "--target", required=True,
-                                 help="target for attack simulation. Use the name of the aws EC2 name")
+                                 help="target for attack simulation. Use the name of the aws EC2 name. ART accepts a "
+                                      "comma delimited list of targets, example: ar-win-ar-ar-0,ar-linux-ar-ar-0")
     simulate_parser.add_argument("-te", "--technique", required=False, type=str, default="",
                                  help="comma delimited list of MITRE ATT&CK technique ID to simulate in the "
                                       "attack_range, example: T1117, T1118")
     simulate_parser.add_argument("-p", "--playbook", required=False, type=str, default="",
                                  help="file path for a simulation playbook")
+    simulate_parser.add_argument("--host_concurrency", required=False, type=positive_int, default=1,
+                                 help="number of ART techniques run at the same time on each target")
 
     simulate_parser.set_defaults(func=simulate)
 
@@ -195,17 +244,47 @@ def main(args):
                              help="earliest time of the splunk search")
     dump_parser.add_argument("--latest", required=False, default="now",
                              help="latest time of the splunk search")
+    dump_parser.add_argument("--compress", required=False, action="store_true",
+                             help="gzip compress the dump while it is written, use a file name ending with .gz")
+    dump_parser.add_argument("--slices", required=False, type=int, default=1,
+                             help="number of time slices of the search exported in parallel")
+    dump_parser.add_argument("--checkpoint", required=False, action="store_true",
+                             help="record the progress of the dump and resume an interrupted dump with the same search")
+    dump_parser.add_argument("--checkpoint_interval", required=False, type=int, default=3600,
+                             help="seconds of the search time range exported between two checkpoints")
     dump_parser.set_defaults(func=dump)
 
     # Replay Arguments
-    replay_parser.add_argument("-fn", "--file_name", required=True,
+    replay_parser.add_argument("-fn", "--file_name", required=False,
                                help="file name of the attack_data")
-    replay_parser.add_argument("--source", required=True,
+    replay_parser.add_argument("--source", required=False,
                         help="source of replayed data")
-    replay_parser.add_argument("--sourcetype", required=True,
+    replay_parser.add_argument("--sourcetype", required=False,
                         help="sourcetype of replayed data")
+    replay_parser.add_argument("--manifest", required=False,
+                        help="YAML or JSON list of attack_data files with file_name, sourcetype, source and index to replay instead of a single file, always replayed through the HTTP Event Collector")
+    replay_parser.add_argument("--parallel_files", required=False, type=int, default=4,
+                        help="number of manifest files replayed in parallel")
     replay_parser.add_argument("--index", required=False, default="test",
                         help="index of replayed data")
+    replay_parser.add_argument("--update_timestamp", required=False, action="store_true",
+                        help="shift the timestamps of the attack_data to the current time while replaying it")
+    replay_parser.add_argument("--workers", required=False, type=int, default=1,
+                        help="number of worker processes shifting the timestamps in parallel with the oneshot engine")
+    replay_parser.add_argument("--engine", required=False, choices=["oneshot", "hec"],
+                        help="upload the data with ansible as oneshot input (default for --file_name) or send it to "
+                             "the HTTP Event Collector (always used for --manifest), which needs port 8088 of the "
+                             "splunk server to be open")
+    replay_parser.add_argument("--batch_size", required=False, type=int, default=1000,
+                        help="number of events sent per HTTP Event Collector request")
+    replay_parser.add_argument("--concurrency", required=False, type=int, default=4,
+                        help="number of concurrent HTTP Event Collector requests")
+    replay_parser.add_argument("--compress", required=False, action="store_true",
+                        help="gzip compress the HTTP Event Collector requests")
+    replay_parser.add_argument("--rate", required=False, type=float,
+                        help="maximum number of events per second sent to the HTTP Event Collector, unlimited by default")
+    replay_parser.add_argument("--speed", required=False, type=float,
+                        help="play the events back in real time with the original gaps between them divided by speed")
     replay_parser.set_defaults(func=replay)
 
     # Show arguments
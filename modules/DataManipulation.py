@@ -1,158 +1,1004 @@
+import concurrent.futures
+import fnmatch
+import gzip
 import json
 from datetime import datetime
 from datetime import timedelta
-import fileinput
+import functools
 import os
 import re
 import io
 import logging
+import mmap
+import shutil
 import sys
+import tempfile
 import argparse
 
+
+# chunk size used when scanning a file for its first or latest timestamp
+SCAN_CHUNK_SIZE = 64 * 1024
+# bytes carried over between chunks so that a timestamp split by a chunk border is still found
+SCAN_OVERLAP = 256
+# maximum number of distinct timestamps remembered while shifting a file
+TIMESTAMP_CACHE_SIZE = 65536
+# buffer size used when concatenating the parts written by worker processes
+COPY_BUFFER_SIZE = 1024 * 1024
+
+MICROSECONDS_PER_SECOND = 1000000
+MICROSECONDS_PER_DAY = 86400 * MICROSECONDS_PER_SECOND
+DAYS_IN_MONTH = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+# days since 0001-01-01 of 9999-12-31, the last date datetime can represent
+MAX_DAYS = 3652058
+# days since 0001-01-01 of 1970-01-01
+UNIX_EPOCH_DAYS = 719162
+
+
+def days_from_civil(year, month, day):
+    """
+    days_from_civil function returns the number of days since 0001-01-01 of a proleptic gregorian date.
+
+    :param year: year
+    :param month: month 1-12
+    :param day: day of the month
+    :return: number of days or None if the date does not exist
+    """
+    if not (1 <= year <= 9999 and 1 <= month <= 12 and 1 <= day <= DAYS_IN_MONTH[month - 1]
+            + (month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0))):
+        return None
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 306
+
+
+def civil_from_days(days):
+    """
+    civil_from_days function is the inverse of days_from_civil.
+
+    :param days: number of days since 0001-01-01
+    :return: tuple of year, month and day
+    """
+    if not 0 <= days <= MAX_DAYS:
+        raise OverflowError("date value out of range")
+    days += 306
+    era = days // 146097
+    day_of_era = days - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    mp = (5 * day_of_year + 2) // 153
+    day = day_of_year - (153 * mp + 2) // 5 + 1
+    month = mp + (3 if mp < 10 else -9)
+    return year_of_era + era * 400 + (month <= 2), month, day
+
+
+# dumps only span a handful of days, so the date half of a timestamp is converted through small caches
+@functools.lru_cache(maxsize=4096)
+def iso_date_to_days(text):
+    if text[4] != '-' or text[7] != '-':
+        return None
+    try:
+        return days_from_civil(int(text[0:4]), int(text[5:7]), int(text[8:10]))
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def days_to_iso_date(days):
+    return '%04d-%02d-%02d' % civil_from_days(days)
+
+
+@functools.lru_cache(maxsize=4096)
+def us_date_to_days(text):
+    if text[2] != '/' or text[5] != '/':
+        return None
+    try:
+        return days_from_civil(int(text[6:10]), int(text[0:2]), int(text[3:5]))
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def days_to_us_date(days):
+    year, month, day = civil_from_days(days)
+    return '%02d/%02d/%04d' % (month, day, year)
+
+
+def parse_clock(text):
+    """
+    parse_clock function parses HH:MM:SS into seconds of the day.
+
+    :param text: time string
+    :return: seconds or None if the time is malformed
+    """
+    if text[2] != ':' or text[5] != ':':
+        return None
+    try:
+        hour = int(text[0:2])
+        minute = int(text[3:5])
+        second = int(text[6:8])
+    except ValueError:
+        return None
+    if not (0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 60):
+        return None
+    return (hour * 60 + minute) * 60 + second
+
+
+class TimestampCodec:
+    """
+    TimestampCodec parses and formats timestamps of one datetime format as microseconds since 0001-01-01,
+    so shifting a timestamp is plain integer arithmetic. Subclasses read fixed-width formats by slicing
+    fixed positions into integers, datetime.strptime is only used for input that does not fit the layout.
+    """
+
+    # smallest step in microseconds the format can represent
+    resolution = 1
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+
+    @staticmethod
+    def for_format(fmt):
+        """
+        for_format function returns the fastest codec available for a datetime format.
+
+        :param fmt: datetime format
+        :return: TimestampCodec object
+        """
+        if fmt == "%Y-%m-%dT%H:%M:%S.%fZ":
+            return IsoTimestampCodec(fmt, fraction=6, suffix='Z')
+        if fmt == "%Y-%m-%dT%H:%M:%SZ":
+            return IsoTimestampCodec(fmt, suffix='Z')
+        if fmt == "%Y-%m-%dT%H:%M:%S":
+            return IsoTimestampCodec(fmt)
+        if fmt == "%m/%d/%Y %I:%M:%S %p":
+            return UsTimestampCodec(fmt)
+        return TimestampCodec(fmt)
+
+    def parse_fixed(self, timestamp):
+        """
+        parse_fixed function parses a timestamp without datetime.strptime.
+
+        :param timestamp: timestamp string
+        :return: microseconds since 0001-01-01 or None if the timestamp does not fit the fixed layout
+        """
+        return None
+
+    def parse(self, timestamp):
+        """
+        parse function parses a timestamp and falls back to datetime.strptime for malformed input.
+
+        :param timestamp: timestamp string
+        :return: microseconds since 0001-01-01, raises ValueError if the timestamp does not match the format
+        """
+        micros = self.parse_fixed(timestamp)
+        if micros is None:
+            micros = (datetime.strptime(timestamp, self.fmt) - datetime(1, 1, 1)) // timedelta(microseconds=1)
+        return micros
+
+    def format(self, micros):
+        """
+        format function formats microseconds since 0001-01-01 as timestamp string.
+
+        :param micros: microseconds since 0001-01-01
+        :return: timestamp string
+        """
+        return (datetime(1, 1, 1) + timedelta(microseconds=micros)).strftime(self.fmt)
+
+    def shift_fixed(self, timestamp, delta):
+        """
+        shift_fixed function moves a timestamp by delta microseconds without datetime.strptime.
+
+        :param timestamp: timestamp string
+        :param delta: microseconds to add
+        :return: shifted timestamp string or None if the timestamp does not fit the fixed layout
+        """
+        micros = self.parse_fixed(timestamp)
+        if micros is None:
+            return None
+        return self.format(micros + delta)
+
+    def shift(self, timestamp, delta):
+        """
+        shift function moves a timestamp by delta microseconds and keeps its format.
+
+        :param timestamp: timestamp string
+        :param delta: microseconds to add
+        :return: shifted timestamp string
+        """
+        shifted = self.shift_fixed(timestamp, delta)
+        if shifted is None:
+            shifted = self.format(self.parse(timestamp) + delta)
+        return shifted
+
+
+class IsoTimestampCodec(TimestampCodec):
+    """
+    IsoTimestampCodec handles YYYY-MM-DDTHH:MM:SS with an optional fraction of up to 9 digits and an optional
+    suffix. Fraction digits below a microsecond are carried over unchanged.
+    """
+
+    def __init__(self, fmt, fraction=0, suffix='', separator='T'):
+        super().__init__(fmt)
+        self.fraction = fraction
+        self.suffix = suffix
+        self.separator = separator
+        self.length = 19 + (fraction + 1 if fraction else 0) + len(suffix)
+        self.resolution = 10 ** (6 - min(fraction, 6))
+
+    def parse_fixed(self, timestamp):
+        if len(timestamp) != self.length or timestamp[10] != self.separator or not timestamp.endswith(self.suffix):
+            return None
+        days = iso_date_to_days(timestamp[0:10])
+        seconds = parse_clock(timestamp[11:19])
+        if days is None or seconds is None:
+            return None
+        micros = (days * 86400 + seconds) * MICROSECONDS_PER_SECOND
+        if self.fraction:
+            fraction = timestamp[20:20 + self.fraction]
+            if timestamp[19] != '.' or not fraction.isdigit():
+                return None
+            micros += int(fraction[:6].ljust(6, '0'))
+        return micros
+
+    def format(self, micros):
+        days, micros = divmod(micros, MICROSECONDS_PER_DAY)
+        seconds, microsecond = divmod(micros, MICROSECONDS_PER_SECOND)
+        minutes, second = divmod(seconds, 60)
+        hour, minute = divmod(minutes, 60)
+        if self.fraction == 6:
+            fraction = '.%06d' % microsecond
+        elif self.fraction:
+            fraction = '.' + ('%06d' % microsecond)[:self.fraction].ljust(self.fraction, '0')
+        else:
+            fraction = ''
+        return '%s%s%02d:%02d:%02d%s%s' % (days_to_iso_date(days), self.separator, hour, minute, second, fraction,
+                                           self.suffix)
+
+    def shift_fixed(self, timestamp, delta):
+        shifted = super().shift_fixed(timestamp, delta)
+        if shifted is not None and self.fraction > 6:
+            shifted = shifted[:26] + timestamp[26:20 + self.fraction] + self.suffix
+        return shifted
+
+
+class UsTimestampCodec(TimestampCodec):
+    """
+    UsTimestampCodec handles MM/DD/YYYY HH:MM:SS AM as written by Windows event logs.
+    """
+
+    resolution = MICROSECONDS_PER_SECOND
+
+    def parse_fixed(self, timestamp):
+        if len(timestamp) != 22 or timestamp[10] != ' ' or timestamp[19] != ' ':
+            return None
+        meridiem = timestamp[20:22]
+        if meridiem != 'AM' and meridiem != 'PM':
+            return None
+        days = us_date_to_days(timestamp[0:10])
+        seconds = parse_clock(timestamp[11:19])
+        if days is None or seconds is None or not 3600 <= seconds < 46800:
+            return None
+        # 12 AM is midnight and 12 PM is noon
+        if seconds >= 43200:
+            seconds -= 43200
+        if meridiem == 'PM':
+            seconds += 43200
+        return (days * 86400 + seconds) * MICROSECONDS_PER_SECOND
+
+    def format(self, micros):
+        days, micros = divmod(micros, MICROSECONDS_PER_DAY)
+        minutes, second = divmod(micros // MICROSECONDS_PER_SECOND, 60)
+        hour, minute = divmod(minutes, 60)
+        return '%s %02d:%02d:%02d %s' % (days_to_us_date(days), hour % 12 or 12, minute, second,
+                                         'AM' if hour < 12 else 'PM')
+
+
+class EpochTimestampCodec(TimestampCodec):
+    """
+    EpochTimestampCodec handles unix epoch seconds with a fixed number of fraction digits, e.g. 1690000000.123
+    """
+
+    def __init__(self, fraction=0):
+        super().__init__(None)
+        self.fraction = fraction
+        self.resolution = 10 ** (6 - fraction)
+
+    def parse_fixed(self, timestamp):
+        seconds, dot, fraction = timestamp.partition('.')
+        if len(fraction) != self.fraction or not seconds.isdigit() or (dot and not fraction.isdigit()):
+            return None
+        micros = (UNIX_EPOCH_DAYS * 86400 + int(seconds)) * MICROSECONDS_PER_SECOND
+        if fraction:
+            micros += int(fraction.ljust(6, '0'))
+        return micros
+
+    def parse(self, timestamp):
+        micros = self.parse_fixed(timestamp)
+        if micros is None:
+            raise ValueError("time data %r is not an epoch timestamp with %d fraction digits" % (timestamp, self.fraction))
+        return micros
+
+    def format(self, micros):
+        seconds, microsecond = divmod(micros - UNIX_EPOCH_DAYS * MICROSECONDS_PER_DAY, MICROSECONDS_PER_SECOND)
+        if seconds < 0 or micros > (MAX_DAYS + 1) * MICROSECONDS_PER_DAY:
+            raise OverflowError("date value out of range")
+        if self.fraction:
+            return '%d.%s' % (seconds, ('%06d' % microsecond)[:self.fraction])
+        return '%d' % seconds
+
+
+def parse_timestamp_with_codecs(codecs, timestamp):
+    """
+    parse_timestamp_with_codecs function parses a timestamp with the first codec matching it.
+
+    :param codecs: list of TimestampCodec objects
+    :param timestamp: timestamp string
+    :return: tuple of microseconds since 0001-01-01 and the matching codec, raises ValueError if no codec matches
+    """
+    for codec in codecs:
+        micros = codec.parse_fixed(timestamp)
+        if micros is not None:
+            return micros, codec
+    for codec in codecs[:-1]:
+        try:
+            return codec.parse(timestamp), codec
+        except ValueError:
+            pass
+    return codecs[-1].parse(timestamp), codecs[-1]
+
+
+def shift_timestamp_with_codecs(codecs, timestamp, delta):
+    """
+    shift_timestamp_with_codecs function shifts a timestamp with the first codec matching it. All fixed layouts
+    are tried before any datetime.strptime fallback.
+
+    :param codecs: list of TimestampCodec objects
+    :param timestamp: timestamp string
+    :param delta: microseconds to add
+    :return: shifted timestamp string, raises ValueError if no codec matches
+    """
+    for codec in codecs:
+        shifted = codec.shift_fixed(timestamp, delta)
+        if shifted is not None:
+            return shifted
+    for codec in codecs[:-1]:
+        try:
+            return codec.shift(timestamp, delta)
+        except ValueError:
+            pass
+    return codecs[-1].shift(timestamp, delta)
+
+
+def json_field_pattern(field):
+    """
+    json_field_pattern function compiles a bytes pattern matching a json string field, the value is group 1.
+
+    :param field: name of the json field
+    :return: compiled bytes pattern
+    """
+    return re.compile(b'"' + re.escape(field.encode('utf-8')) + rb'"\s*:\s*"([^"\\]*)"')
+
+
+class TimestampShifter:
+    """
+    TimestampShifter describes where the timestamps of one kind of data are and how they are written. The
+    timestamp is the matched group of a bytes pattern, or the whole match if the pattern has no group.
+    Shifters are registered in TIMESTAMP_SHIFTERS, so supporting another sourcetype only needs another entry.
+    """
+
+    def __init__(self, name, pattern, codecs, sourcetypes=(), sources=(), latest_event='last', event_start=None):
+        """
+        :param name: unique name of the shifter
+        :param pattern: compiled bytes pattern locating the timestamps
+        :param codecs: TimestampCodec objects of the timestamp formats, tried in order
+        :param sourcetypes: sourcetypes handled by the shifter, wildcards are allowed
+        :param sources: sources handled by the shifter, wildcards are allowed
+        :param latest_event: 'first' or 'last', where the latest event of a file is
+        :param event_start: bytes regex matching the first line of a multi-line event, None if every line is an event
+        """
+        self.name = name
+        self.pattern = pattern
+        self.codecs = codecs
+        self.sourcetypes = sourcetypes
+        self.sources = sources
+        self.latest_event = latest_event
+        self.event_start = re.compile(event_start) if event_start else None
+
+    def find_latest_timestamp(self, file_path):
+        """
+        find_latest_timestamp function returns the timestamp of the latest event of a file.
+
+        :param file_path: file path location
+        :return: timestamp string or None if the file contains no timestamp
+        """
+        if self.latest_event == 'first':
+            return find_first_match(file_path, self.pattern)
+        return find_last_match(file_path, self.pattern)
+
+    def create_buffer_shifter(self, shift_timestamp, logger, validate_json=False):
+        """
+        create_buffer_shifter function returns a generator function shifting all timestamps in a byte range of a
+        buffer, e.g. a memory-mapped file. It yields the untouched slices between the timestamps as memoryview
+        and the shifted timestamps as bytes, so only the timestamps are ever copied or decoded.
+
+        :param shift_timestamp: memoized function shifting a timestamp given as bytes
+        :param logger: logger object
+        :param validate_json: parse json lines completely, only used by json shifters
+        :return: generator function taking the buffer, start and end offset
+        """
+        pattern = self.pattern
+
+        def shift_buffer(buffer, start, end):
+            with memoryview(buffer) as view:
+                position = start
+                for match in pattern.finditer(buffer, start, end):
+                    group = match.lastindex or 0
+                    try:
+                        shifted = shift_timestamp(match.group(group))
+                    except (ValueError, OverflowError) as e:
+                        logger.error("Error in timestamp replacement occured: " + str(e))
+                        continue
+                    yield view[position:match.start(group)]
+                    yield shifted
+                    position = match.end(group)
+                yield view[position:end]
+
+        return shift_buffer
+
+
+class RegexTimestampShifter(TimestampShifter):
+    """
+    RegexTimestampShifter shifts every timestamp matched by a regular expression.
+    """
+
+    def __init__(self, name, regex, codecs, **kwargs):
+        super().__init__(name, re.compile(regex), codecs, **kwargs)
+
+
+class JsonTimestampShifter(TimestampShifter):
+    """
+    JsonTimestampShifter shifts a string field of json lines. The field is located with a bytes pattern and the
+    shifted value is spliced into the line, with validate_json every line is parsed completely instead.
+    """
+
+    def __init__(self, name, field, codecs, **kwargs):
+        super().__init__(name, json_field_pattern(field), codecs, **kwargs)
+        self.field = field
+
+    def create_line_shifter(self, shift_timestamp, logger):
+        """
+        create_line_shifter function returns a function parsing a json line completely and shifting its field.
+        Lines which can not be parsed or shifted are logged and kept.
+
+        :param shift_timestamp: memoized function shifting a timestamp given as bytes
+        :param logger: logger object
+        :return: line function
+        """
+        def shift_line(line):
+            if not line.strip():
+                return line
+            try:
+                original_time = json.loads(line)[self.field].encode('utf-8')
+                return line.replace(original_time, shift_timestamp(original_time))
+            except (ValueError, KeyError, TypeError, AttributeError, OverflowError) as e:
+                logger.error("Error in timestamp replacement occured: " + str(e))
+                return line
+
+        return shift_line
+
+    def create_buffer_shifter(self, shift_timestamp, logger, validate_json=False):
+        if not validate_json:
+            return super().create_buffer_shifter(shift_timestamp, logger)
+
+        shift_line = self.create_line_shifter(shift_timestamp, logger)
+
+        def shift_buffer(buffer, start, end):
+            position = start
+            while position < end:
+                line_end = buffer.find(b'\n', position, end) + 1 or end
+                yield shift_line(buffer[position:line_end])
+                position = line_end
+
+        return shift_buffer
+
+
+TIMESTAMP_SHIFTERS = {shifter.name: shifter for shifter in [
+    JsonTimestampShifter(
+        'cloudtrail', 'eventTime',
+        [TimestampCodec.for_format("%Y-%m-%dT%H:%M:%S.%fZ"), TimestampCodec.for_format("%Y-%m-%dT%H:%M:%SZ")],
+        sourcetypes=['aws:cloudtrail'], latest_event='first'),
+    JsonTimestampShifter(
+        'exchange', 'CreationTime',
+        [TimestampCodec.for_format("%Y-%m-%dT%H:%M:%S")],
+        sources=['exchange'], latest_event='first'),
+    RegexTimestampShifter(
+        'windows', rb'\d{2}/\d{2}/\d{4} \d{2}:\d{2}:\d{2} [AP]M',
+        [TimestampCodec.for_format("%m/%d/%Y %I:%M:%S %p")],
+        sourcetypes=['WinEventLog'], sources=['WinEventLog:*'],
+        event_start=rb'\d{2}/\d{2}/\d{4} \d{2}:\d{2}:\d{2} [AP]M'),
+    RegexTimestampShifter(
+        'xmlwineventlog', rb"SystemTime='([^']+)'|<Data Name='UtcTime'>([^<]+)</Data>",
+        [IsoTimestampCodec("%Y-%m-%dT%H:%M:%S.%fZ", fraction=7, suffix='Z'),
+         IsoTimestampCodec("%Y-%m-%dT%H:%M:%S.%fZ", fraction=9, suffix='Z'),
+         IsoTimestampCodec("%Y-%m-%dT%H:%M:%S.%fZ", fraction=6, suffix='Z'),
+         IsoTimestampCodec("%Y-%m-%d %H:%M:%S.%f", fraction=3, separator=' ')],
+        sourcetypes=['XmlWinEventLog', 'xmlwineventlog'], sources=['XmlWinEventLog:*']),
+    RegexTimestampShifter(
+        'linux_audit', rb'audit\((\d+\.\d{3}):',
+        [EpochTimestampCodec(fraction=3)],
+        sourcetypes=['linux:audit', 'linux_audit']),
+    RegexTimestampShifter(
+        'zeek', rb'"ts"\s*:\s*(\d+\.\d{6})\b',
+        [EpochTimestampCodec(fraction=6)],
+        sourcetypes=['bro:*:json', 'zeek:*:json']),
+    JsonTimestampShifter(
+        'okta', 'published',
+        [IsoTimestampCodec("%Y-%m-%dT%H:%M:%S.%fZ", fraction=3, suffix='Z')],
+        sourcetypes=['OktaIM2:log']),
+]}
+
+
+def index_timestamp_shifters(attribute):
+    """
+    index_timestamp_shifters function maps the exact names of a shifter attribute to the shifter and collects
+    the wildcard patterns separately.
+
+    :param attribute: 'sourcetypes' or 'sources'
+    :return: tuple of dict from name to shifter and list of (pattern, shifter)
+    """
+    exact = {}
+    patterns = []
+    for shifter in TIMESTAMP_SHIFTERS.values():
+        for name in getattr(shifter, attribute):
+            if any(char in name for char in '*?['):
+                patterns.append((name, shifter))
+            else:
+                exact[name] = shifter
+    return exact, patterns
+
+
+SHIFTERS_BY_SOURCETYPE, SHIFTER_SOURCETYPE_PATTERNS = index_timestamp_shifters('sourcetypes')
+SHIFTERS_BY_SOURCE, SHIFTER_SOURCE_PATTERNS = index_timestamp_shifters('sources')
+
+
+def find_timestamp_shifter(sourcetype, source):
+    """
+    find_timestamp_shifter function returns the shifter registered for a sourcetype or source. Exact names are
+    dict lookups, wildcard patterns are only tried when no exact name matches.
+
+    :param sourcetype: log source type
+    :param source: source type
+    :return: TimestampShifter object or None
+    """
+    shifter = SHIFTERS_BY_SOURCETYPE.get(sourcetype) or SHIFTERS_BY_SOURCE.get(source)
+    if shifter is not None:
+        return shifter
+    for pattern, shifter in SHIFTER_SOURCETYPE_PATTERNS:
+        if fnmatch.fnmatchcase(sourcetype, pattern):
+            return shifter
+    for pattern, shifter in SHIFTER_SOURCE_PATTERNS:
+        if fnmatch.fnmatchcase(source, pattern):
+            return shifter
+    return None
+
+
+def match_timestamp(match):
+    """
+    match_timestamp function returns the timestamp of a match as string.
+
+    :param match: match of a shifter pattern
+    :return: timestamp string
+    """
+    return match.group(match.lastindex or 0).decode('utf-8')
+
+
+def open_dump(file_path):
+    """
+    open_dump function opens a file for reading bytes, files ending with .gz are decompressed while they are read.
+
+    :param file_path: file path location
+    :return: file object
+    """
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    return io.open(file_path, "rb")
+
+
+def find_first_match(file_path, pattern):
+    """
+    find_first_match function reads a file forwards in chunks and returns the timestamp of the first match.
+
+    :param file_path: file path location
+    :param pattern: compiled bytes pattern
+    :return: timestamp string or None
+    """
+    overlap = b''
+    with open_dump(file_path) as f:
+        while True:
+            chunk = f.read(SCAN_CHUNK_SIZE)
+            if not chunk:
+                return None
+            buffer = overlap + chunk
+            match = pattern.search(buffer)
+            if match is not None:
+                return match_timestamp(match)
+            overlap = buffer[-SCAN_OVERLAP:]
+
+
+def find_last_match(file_path, pattern):
+    """
+    find_last_match function reads a file backwards in chunks and returns the timestamp of the last match.
+    Only the tail of the file is read in the common case, whatever the file size.
+
+    :param file_path: file path location
+    :param pattern: compiled bytes pattern
+    :return: timestamp string or None
+    """
+    if file_path.endswith(".gz"):
+        return find_last_match_forward(file_path, pattern)
+
+    overlap = b''
+    with io.open(file_path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            read_size = min(SCAN_CHUNK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            buffer = f.read(read_size) + overlap
+
+            last_match = None
+            for last_match in pattern.finditer(buffer):
+                pass
+            if last_match is not None:
+                return match_timestamp(last_match)
+
+            overlap = buffer[:SCAN_OVERLAP]
+
+    return None
+
+
+def find_last_match_forward(file_path, pattern):
+    """
+    find_last_match_forward function reads a file forwards in chunks and returns the timestamp of the last match.
+    Compressed files can not be read backwards, so they are decompressed once from the start.
+
+    :param file_path: file path location
+    :param pattern: compiled bytes pattern
+    :return: timestamp string or None
+    """
+    last_timestamp = None
+    overlap = b''
+    with open_dump(file_path) as f:
+        while True:
+            chunk = f.read(SCAN_CHUNK_SIZE)
+            if not chunk:
+                return last_timestamp
+            buffer = overlap + chunk
+
+            last_match = None
+            for last_match in pattern.finditer(buffer):
+                pass
+            if last_match is not None:
+                last_timestamp = match_timestamp(last_match)
+
+            overlap = buffer[-SCAN_OVERLAP:]
+
+
 class DataManipulation:
 
-    def manipulate_timestamp(self, file_path, logger, sourcetype, source):
+    # parse every json line completely instead of only locating the timestamp field
+    validate_json = False
+
+    def manipulate_timestamp(self, file_path, logger, sourcetype, source, workers=1, validate_json=False):
         """
-        manipulate_timestamp function manipulates the timestamp of the log file.
+        manipulate_timestamp function manipulates the timestamp of the log file. The shifter is looked up in
+        TIMESTAMP_SHIFTERS by sourcetype and source.
 
         :param file_path: file path location
         :param logger: logger object
         :param sourcetype: log source type
         :param source: source type
+        :param workers: number of worker processes shifting the file in parallel
+        :param validate_json: parse every json line instead of splicing the timestamp field in place
         :return: No return values
         """
 
         self.logger = logger
+        self.validate_json = validate_json
 
-        if sourcetype == 'aws:cloudtrail':
-            self.manipulate_timestamp_cloudtrail(file_path, logger)
-
-        if source == 'WinEventLog:System' or source == 'WinEventLog:Security':
-            self.manipulate_timestamp_windows_event_log_raw(file_path, logger)
+        shifter = find_timestamp_shifter(sourcetype, source)
+        if shifter is None:
+            logger.info("no timestamp shifter registered for sourcetype %s and source %s, timestamps are kept"
+                        % (sourcetype, source))
+            return
 
-        if source == 'exchange':
-            self.manipulate_timestamp_exchange_logs(file_path, logger)
+        self.shift_file(file_path, shifter, logger, workers)
 
 
-    def manipulate_timestamp_exchange_logs(self, file_path, logger):
+    def manipulate_timestamp_exchange_logs(self, file_path, logger, workers=1):
         """
         manipulate_timestamp_exchange_logs function manipulates exchange logs
 
         :param file_path: file path location
         :param logger: logger object
+        :param workers: number of worker processes shifting the file in parallel
         :return: No return values        
         """
-        f = io.open(file_path, "r", encoding="utf-8")
+        self.shift_file(file_path, TIMESTAMP_SHIFTERS['exchange'], logger, workers)
+
 
-        first_line = f.readline()
-        d = json.loads(first_line)
-        latest_event  = datetime.strptime(d["CreationTime"],"%Y-%m-%dT%H:%M:%S")
+    def manipulate_timestamp_windows_event_log_raw(self, file_path, logger, workers=1):
+        """
+        manipulate_timestamp_windows_event_log_raw function manipulates windows event logs
 
-        now = datetime.now()
-        now = now.strftime("%Y-%m-%dT%H:%M:%S")
-        now = datetime.strptime(now,"%Y-%m-%dT%H:%M:%S")
+        :param file_path: file path location
+        :param logger: logger object
+        :param workers: number of worker processes shifting the file in parallel
+        :return: No return values        
+        """
+        self.shift_file(file_path, TIMESTAMP_SHIFTERS['windows'], logger, workers)
 
-        difference = now - latest_event
-        f.close()
 
-        for line in fileinput.input(file_path, inplace=True):
-            d = json.loads(line)
-            original_time = datetime.strptime(d["CreationTime"],"%Y-%m-%dT%H:%M:%S")
-            new_time = (difference + original_time)
+    def manipulate_timestamp_cloudtrail(self, file_path, logger, workers=1):
+        """
+        manipulate_timestamp_cloudtrail function manipulates AWS cloudtrail logs
 
-            original_time = original_time.strftime("%Y-%m-%dT%H:%M:%S")
-            new_time = new_time.strftime("%Y-%m-%dT%H:%M:%S")
-            print (line.replace(original_time, new_time),end ='')
+        :param file_path: file path location
+        :param logger: logger object
+        :param workers: number of worker processes shifting the file in parallel
+        :return: No return values        
+        """
+        self.shift_file(file_path, TIMESTAMP_SHIFTERS['cloudtrail'], logger, workers)
 
 
-    def manipulate_timestamp_windows_event_log_raw(self, file_path, logger):
+    def shift_file(self, file_path, shifter, logger, workers=1):
         """
-        manipulate_timestamp_windows_event_log_raw function manipulates windows event logs
+        shift_file function moves all timestamps of a file so that its latest event happens now.
 
         :param file_path: file path location
+        :param shifter: TimestampShifter object
         :param logger: logger object
-        :return: No return values        
+        :param workers: number of worker processes shifting the file in parallel
+        :return: No return values
         """
-        f = io.open(file_path, "r", encoding="utf-8")
-        self.now = datetime.now()
-        self.now = self.now.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-        self.now = datetime.strptime(self.now,"%Y-%m-%dT%H:%M:%S.%fZ")
+        self.logger = logger
 
-        # read raw logs
-        regex = r'\d{2}/\d{2}/\d{4} \d{2}:\d{2}:\d{2} [AP]M'
-        data = f.read()
-        lst_matches = re.findall(regex, data)
-        if len(lst_matches) > 0:
-            latest_event  = datetime.strptime(lst_matches[-1],"%m/%d/%Y %I:%M:%S %p")
-            self.difference = self.now - latest_event
-            f.close()
+        if self.compute_difference(file_path, shifter, logger):
+            self.rewrite_file(file_path, shifter.name, logger, workers)
 
-            result = re.sub(regex, self.replacement_function, data)
 
-            with io.open(file_path, "w+", encoding='utf8') as f:
-                f.write(result)
-        else:
-            f.close()
+    def compute_difference(self, file_path, shifter, logger):
+        """
+        compute_difference function sets self.difference to the time between the latest event of a file and now.
+
+        :param file_path: file path location
+        :param shifter: TimestampShifter object
+        :param logger: logger object
+        :return: False if the file contains no timestamp
+        """
+        latest_timestamp = shifter.find_latest_timestamp(file_path)
+        if latest_timestamp is None:
+            logger.info("no %s timestamp found in %s" % (shifter.name, file_path))
+            return False
+
+        latest_event, codec = parse_timestamp_with_codecs(shifter.codecs, latest_timestamp)
+        # now is cut to the resolution of the latest timestamp, so the latest event is shifted to exactly now
+        now = (datetime.now() - datetime(1, 1, 1)) // timedelta(microseconds=1)
+        now -= now % codec.resolution
+
+        self.difference = timedelta(microseconds=now - latest_event)
+        return True
+
+
+    def create_batch_shifter(self, file_path, logger, sourcetype, source, validate_json=False):
+        """
+        create_batch_shifter function returns a function shifting the timestamps of a batch of whole lines read
+        from a file, so that the latest event of the file happens now. The file itself is not modified.
+
+        :param file_path: file path location
+        :param logger: logger object
+        :param sourcetype: log source type
+        :param source: source type
+        :param validate_json: parse every json line instead of splicing the timestamp field in place
+        :return: function taking and returning bytes or None if the timestamps can not be shifted, its cache_info
+                 attribute reports the hits and misses of the timestamp cache
+        """
+        self.logger = logger
+        self.validate_json = validate_json
+
+        shifter = find_timestamp_shifter(sourcetype, source)
+        if shifter is None:
+            logger.info("no timestamp shifter registered for sourcetype %s and source %s, timestamps are kept"
+                        % (sourcetype, source))
+            return None
+        if not self.compute_difference(file_path, shifter, logger):
+            return None
+
+        shift_buffer, shift_timestamp = self.create_buffer_shifter(shifter)
+
+        def shift_batch(batch):
+            return b''.join(shift_buffer(batch, 0, len(batch)))
+
+        shift_batch.cache_info = shift_timestamp.cache_info
+        return shift_batch
+
+
+    def split_file(self, file_path, parts):
+        """
+        split_file function splits a file into byte ranges of about the same size which start and end on line boundaries.
+
+        :param file_path: file path location
+        :param parts: number of ranges
+        :return: list of (start, end) byte offsets
+        """
+        size = os.path.getsize(file_path)
+        boundaries = [0]
+        with io.open(file_path, "rb") as f:
+            for i in range(1, parts):
+                f.seek(max(size * i // parts, boundaries[-1]))
+                f.readline()
+                boundary = min(f.tell(), size)
+                if boundary > boundaries[-1]:
+                    boundaries.append(boundary)
+        if boundaries[-1] < size or size == 0:
+            boundaries.append(size)
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+    def rewrite_file(self, file_path, shifter_name, logger, workers=1):
+        """
+        rewrite_file function shifts every line of a file into a temporary file, which atomically replaces the
+        original file once it is completely written. With more than one worker the file is split into byte ranges
+        on line boundaries, which worker processes shift with the same time difference. Their outputs are
+        concatenated in order, so the result is byte-identical to the serial run.
+
+        :param file_path: file path location
+        :param shifter_name: name of a shifter in TIMESTAMP_SHIFTERS
+        :param logger: logger object
+        :param workers: number of worker processes
+        :return: No return values
+        """
+        if file_path.endswith(".gz"):
+            self.rewrite_compressed_file(file_path, shifter_name, logger, workers)
             return
 
+        directory = os.path.dirname(os.path.abspath(file_path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(file_path) + '.', suffix='.tmp', dir=directory)
+        os.close(fd)
 
-    def replacement_function(self, match):
+        ranges = self.split_file(file_path, max(1, workers))
+        jobs = [(file_path, start, end, tmp_path + '.' + str(i), shifter_name, self.difference, self.validate_json,
+                 logger.name)
+                for i, (start, end) in enumerate(ranges)]
         try:
-            event_time = datetime.strptime(match.group(),"%m/%d/%Y %I:%M:%S %p")
-            new_time = self.difference + event_time
-            return new_time.strftime("%m/%d/%Y %I:%M:%S %p")
-        except Exception as e:
-            self.logger.error("Error in timestamp replacement occured: " + str(e))
-            return match.group()
+            if len(jobs) == 1:
+                results = [shift_byte_range(jobs[0])]
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=len(jobs)) as executor:
+                    results = list(executor.map(shift_byte_range, jobs))
+
+            with io.open(tmp_path, "wb") as dst:
+                for job in jobs:
+                    with io.open(job[3], "rb") as part:
+                        shutil.copyfileobj(part, dst, COPY_BUFFER_SIZE)
+                    os.remove(job[3])
+            shutil.copymode(file_path, tmp_path)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            for path in [tmp_path] + [job[3] for job in jobs]:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        self.log_timestamp_cache_stats(sum(hits for hits, misses in results),
+                                       sum(misses for hits, misses in results), logger)
 
 
-    def manipulate_timestamp_cloudtrail(self, file_path, logger):
+    def rewrite_compressed_file(self, file_path, shifter_name, logger, workers=1):
         """
-        manipulate_timestamp_cloudtrail function manipulates AWS cloudtrail logs
+        rewrite_compressed_file function shifts the timestamps of a gzip file. The file is decompressed into a
+        temporary file next to it, which is shifted like an uncompressed file and compressed again into another
+        temporary file. That one atomically replaces the original file.
 
         :param file_path: file path location
+        :param shifter_name: name of a shifter in TIMESTAMP_SHIFTERS
         :param logger: logger object
-        :return: No return values        
+        :param workers: number of worker processes
+        :return: No return values
         """
-        f = io.open(file_path, "r", encoding="utf-8")
-
+        directory = os.path.dirname(os.path.abspath(file_path))
+        prefix = '.' + os.path.basename(file_path) + '.'
+        fd, plain_path = tempfile.mkstemp(prefix=prefix, suffix='.log', dir=directory)
+        os.close(fd)
+        fd, tmp_path = tempfile.mkstemp(prefix=prefix, suffix='.tmp', dir=directory)
+        os.close(fd)
         try:
-            first_line = f.readline()
-            d = json.loads(first_line)
-            latest_event  = datetime.strptime(d["eventTime"],"%Y-%m-%dT%H:%M:%S.%fZ")
+            with gzip.open(file_path, "rb") as src, io.open(plain_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+            self.rewrite_file(plain_path, shifter_name, logger, workers)
+            with io.open(plain_path, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+            shutil.copymode(file_path, tmp_path)
+            os.replace(tmp_path, file_path)
+        finally:
+            for path in [plain_path, tmp_path]:
+                if os.path.exists(path):
+                    os.remove(path)
 
-            now = datetime.now()
-            now = now.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-            now = datetime.strptime(now,"%Y-%m-%dT%H:%M:%S.%fZ")
-        except ValueError:
-            first_line = f.readline()
-            d = json.loads(first_line)
-            latest_event  = datetime.strptime(d["eventTime"],"%Y-%m-%dT%H:%M:%SZ")
 
-            now = datetime.now()
-            now = now.strftime("%Y-%m-%dT%H:%M:%SZ")
-            now = datetime.strptime(now,"%Y-%m-%dT%H:%M:%SZ")
+    def create_buffer_shifter(self, shifter):
+        """
+        create_buffer_shifter function returns a generator function shifting the timestamps in a byte range of a
+        buffer by self.difference. Only the timestamps are decoded.
 
-        difference = now - latest_event
-        f.close()
+        :param shifter: TimestampShifter object
+        :return: tuple of the buffer function and the memoized timestamp function it uses
+        """
+        shift_timestamp = self.create_timestamp_cache(shifter.codecs)
+        return shifter.create_buffer_shifter(shift_timestamp, self.logger, self.validate_json), shift_timestamp
+
+
+    def create_timestamp_cache(self, codecs):
+        """
+        create_timestamp_cache function returns a memoized function which maps an original timestamp to the
+        timestamp shifted by self.difference, both utf-8 encoded. Dumps repeat the same timestamp for many
+        events, so every distinct timestamp is only parsed and formatted once.
+
+        :param codecs: TimestampCodec objects to try in order, the shifted timestamp keeps the matching format
+        :return: memoized shift function
+        """
+        delta = self.difference // timedelta(microseconds=1)
+
+        @functools.lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+        def shift_timestamp(timestamp):
+            return shift_timestamp_with_codecs(codecs, timestamp.decode('utf-8'), delta).encode('utf-8')
+
+        return shift_timestamp
+
+
+    def log_timestamp_cache_stats(self, hits, misses, logger):
+        """
+        log_timestamp_cache_stats function logs hits and misses of the timestamp caches.
+
+        :param hits: number of cache hits
+        :param misses: number of cache misses
+        :param logger: logger object
+        :return: No return values
+        """
+        lookups = hits + misses
+        hit_rate = 100.0 * hits / lookups if lookups else 0.0
+        logger.info("timestamp cache: %d hits, %d misses, %.1f%% hit rate" % (hits, misses, hit_rate))
+
+
+def shift_byte_range(job):
+    """
+    shift_byte_range function shifts the timestamps of one byte range of a file into a part file.
+    It runs in worker processes, so it only takes picklable arguments.
+
+    :param job: tuple of file path, start offset, end offset, part file path, shifter name, time difference,
+                validate_json flag and logger name
+    :return: tuple of timestamp cache hits and misses
+    """
+    file_path, start, end, part_path, shifter_name, difference, validate_json, logger_name = job
+
+    data_manipulation = DataManipulation()
+    data_manipulation.logger = logging.getLogger(logger_name)
+    data_manipulation.difference = difference
+    data_manipulation.validate_json = validate_json
+    shift_buffer, shift_timestamp = data_manipulation.create_buffer_shifter(TIMESTAMP_SHIFTERS[shifter_name])
+
+    # the input is memory-mapped and scanned in place, untouched slices are written without being copied
+    with io.open(file_path, "rb") as src, io.open(part_path, "wb") as dst:
+        if end > start:
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                dst.writelines(shift_buffer(buffer, start, end))
+
+    info = shift_timestamp.cache_info()
+    return info.hits, info.misses
 
-        for line in fileinput.input(file_path, inplace=True):
-            try:
-                d = json.loads(line)
-                original_time = datetime.strptime(d["eventTime"],"%Y-%m-%dT%H:%M:%S.%fZ")
-                new_time = (difference + original_time)
-
-                original_time = original_time.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-                new_time = new_time.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-                print (line.replace(original_time, new_time),end ='')
-            except ValueError:
-                d = json.loads(line)
-                original_time = datetime.strptime(d["eventTime"],"%Y-%m-%dT%H:%M:%SZ")
-                new_time = (difference + original_time)
-
-                original_time = original_time.strftime("%Y-%m-%dT%H:%M:%SZ")
-                new_time = new_time.strftime("%Y-%m-%dT%H:%M:%SZ")
-                print (line.replace(original_time, new_time),end ='')
 
 def setup_logging():
     """
@@ -185,12 +1031,17 @@ def main(args):
                         help="sourcetype of the data to manipulate")
     parser.add_argument("--source", required=True,
                         help="source of the data to manipulate")
+    parser.add_argument("--workers", required=False, type=int, default=1,
+                        help="number of worker processes shifting the file in parallel")
+    parser.add_argument("--validate_json", required=False, action="store_true",
+                        help="parse every json line completely instead of only locating the timestamp field")
     parser.set_defaults(func=lambda _: parser.print_help())
     args = parser.parse_args()
 
     logger = setup_logging()
     data_manipulation = DataManipulation()
-    data_manipulation.manipulate_timestamp(args.path, logger, args.sourcetype, args.source)
+    data_manipulation.manipulate_timestamp(args.path, logger, args.sourcetype, args.source, args.workers,
+                                           args.validate_json)
     logger.info("completed successfully")
 
 
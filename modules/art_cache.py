@@ -0,0 +1,48 @@
+import os
+import time
+import shutil
+import urllib.request
+
+
+# the atomics archive is downloaded once to the controller and copied to the servers from there
+ART_CACHE_TTL = 7 * 86400
+ART_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.attack_range', 'art')
+
+
+def get_atomics_archive_path(repository, branch, ttl=ART_CACHE_TTL):
+    """
+    get_atomics_archive_path function returns the path of the cached atomic red team archive without downloading it.
+    An expired archive is removed, so that it is downloaded again by the next user of the path.
+
+    :param repository: owner of the atomic-red-team repository
+    :param branch: branch of the atomic-red-team repository
+    :param ttl: seconds after which the archive is downloaded again
+    :return: path of the zip archive on the controller
+    """
+    path = os.path.join(ART_CACHE_DIR, 'atomic-red-team-' + repository + '-' + branch.replace('/', '_') + '.zip')
+    if os.path.isfile(path) and time.time() - os.path.getmtime(path) >= ttl:
+        os.remove(path)
+    os.makedirs(ART_CACHE_DIR, exist_ok=True)
+    return path
+
+
+def get_atomics_archive(repository, branch, logger, ttl=ART_CACHE_TTL):
+    """
+    get_atomics_archive function returns the path of the cached atomic red team archive and downloads it if needed.
+
+    :param repository: owner of the atomic-red-team repository
+    :param branch: branch of the atomic-red-team repository
+    :param logger: logger
+    :param ttl: seconds after which the archive is downloaded again
+    :return: path of the zip archive on the controller
+    """
+    path = get_atomics_archive_path(repository, branch, ttl)
+    if os.path.isfile(path):
+        return path
+
+    url = 'https://github.com/' + repository + '/atomic-red-team/archive/' + branch + '.zip'
+    logger.info('Downloading the atomics of ' + url + ' to ' + path)
+    with urllib.request.urlopen(url) as response, open(path + '.tmp', 'wb') as archive:
+        shutil.copyfileobj(response, archive)
+    os.replace(path + '.tmp', path)
+    return path
@@ -1,85 +1,165 @@
 
 import ansible_runner
+import logging
 import os
 import shutil
+import tempfile
+
+from datetime import datetime
+from tabulate import tabulate
 
 from modules.simulation_controller import SimulationController
-from modules import aws_service, azure_service
+from modules import aws_service, azure_service, art_cache
 
 
-class ArtSimulationController(SimulationController):
+# name of the task in the role which runs a technique, its events give the timing and status of every technique
+RUN_TASK = 'Run specified Atomic Red Team Technique'
 
-    def simulate(self, target, technique) -> None:
-        if self.config['general']['cloud_provider'] == 'aws':
-            target_public_ip = aws_service.get_single_instance_public_ip(target, self.config['general']['key_name'], self.config['general']['attack_range_name'], self.config['aws']['region'])
-            private_key_path = self.config['aws']['private_key_path']
-            if "win" in target:
-                ansible_user = 'Administrator'
-                ansible_port = 5985
-                cmd_line=str('-i ' + target_public_ip + ', ')
-            else:
-                ansible_user = 'ubuntu'
-                ansible_port = 22
-                cmd_line = '-u ' + ansible_user + ' --private-key ' + private_key_path + ' -i ' + target_public_ip + ', '
 
-        elif self.config['general']['cloud_provider'] == 'azure':
-            target_public_ip = azure_service.get_instance(target, self.config['general']['key_name'], self.config['general']['attack_range_name'])['public_ip']
-            if "win" in target:
-                ansible_user = 'AzureAdmin'
-                ansible_port = 5985
-                cmd_line=str('-i ' + target_public_ip + ', ')
-            else:
-                ansible_user = 'ubuntu'
-                ansible_port = 22
-                cmd_line = '-u ' + ansible_user + ' --private-key ' + private_key_path + ' -i ' + target_public_ip + ', '
-            private_key_path = self.config['azure']['private_key_path']
+class ArtSimulationController(SimulationController):
 
-        elif self.config['general']['cloud_provider'] == 'local':
-            ansible_user = 'Administrator'
-            target_public_ip = '192.168.56.' + str(14 + int(target[-1]))
-            if "win" in target:
-                ansible_port = 5985 + int(target[-1])
-                cmd_line=str('-i ' + target_public_ip + ', ')
-            else:
-                ansible_port = 2022 + int(target[-1])
-                cmd_line = '-u vagrant --private-key vagrant/.vagrant/machines/' + target + '/virtualbox/private_key -i ' + target_public_ip + ', '
+    def simulate(self, target, technique, host_concurrency=1) -> None:
+        targets = [t.strip() for t in target.split(',') if t.strip()]
+        techniques = [t.strip() for t in technique.split(',') if t.strip()]
 
-        techniques = technique.split(',')
+        for t in targets:
+            if "win" not in t and "linux" not in t:
+                print("ERROR: Target " + t + " is not supported by Atomic Red Team.")
+                return
 
-        if "win" in target:
-            runner = ansible_runner.run(
-                private_data_dir=os.path.join(os.path.dirname(__file__), '../'),
-                cmdline=cmd_line,
-                roles_path=os.path.join(os.path.dirname(__file__), 'ansible/roles'),
-                playbook=os.path.join(os.path.dirname(__file__), 'ansible/atomic_red_team.yml'),
-                extravars= {
-                    'ansible_port': ansible_port, 
-                    'ansible_connection': 'winrm',
-                    'ansible_winrm_server_cert_validation': 'ignore',
-                    'techniques': techniques, 
-                    'ansible_user': ansible_user, 
-                    'ansible_password': self.config['general']['attack_range_password'], 
-                    'art_repository': self.config['simulation']['atomic_red_team_repo'], 
-                    'art_branch': self.config['simulation']['atomic_red_team_branch']
-                },
-                verbosity=0
+        # only the path is passed, the archive is downloaded by the playbook when a windows target lacks the atomics
+        self.atomics_archive = ''
+        if self.config['simulation']['atomic_red_team_cache'] == '1' and any("win" in t for t in targets):
+            self.atomics_archive = art_cache.get_atomics_archive_path(
+                self.config['simulation']['atomic_red_team_repo'],
+                self.config['simulation']['atomic_red_team_branch']
             )
 
-        elif "linux" in target:
+        # the techniques of a target are dealt round robin to its workers, the aliases of the target in art_workers
+        hosts = {}
+        workers = {}
+        for t in targets:
+            host_vars = self.get_host_vars(t)
+            host_vars['art_windows'] = "win" in t
+            hosts[t] = dict(host_vars, techniques=techniques)
+            worker_count = min(host_concurrency, len(techniques))
+            for i in range(worker_count):
+                worker = t if worker_count == 1 else '%s_worker_%d' % (t, i + 1)
+                workers[worker] = dict(host_vars, art_host=t, techniques=techniques[i::worker_count])
+
+        inventory = {'all': {'children': {
+            'art_hosts': {'hosts': hosts},
+            'art_workers': {'hosts': workers}
+        }}}
+
+        private_data_dir = tempfile.mkdtemp(prefix='ar-art-')
+        try:
             runner = ansible_runner.run(
-                private_data_dir=os.path.join(os.path.dirname(__file__), '../'),
-                cmdline=cmd_line,
+                private_data_dir=private_data_dir,
+                inventory=inventory,
+                forks=max(len(hosts), len(workers)),
                 roles_path=os.path.join(os.path.dirname(__file__), 'ansible/roles'),
                 playbook=os.path.join(os.path.dirname(__file__), 'ansible/atomic_red_team.yml'),
-                extravars= {
-                    'ansible_port': ansible_port, 
-                    'ansible_python_interpreter': '/usr/bin/python3',
-                    'techniques': techniques, 
-                    'art_repository': self.config['simulation']['atomic_red_team_repo'], 
-                    'art_branch': self.config['simulation']['atomic_red_team_branch']
+                extravars={
+                    'art_repository': self.config['simulation']['atomic_red_team_repo'],
+                    'art_branch': self.config['simulation']['atomic_red_team_branch'],
+                    'art_atomics_archive': self.atomics_archive
                 },
                 verbosity=0
             )
+            results = self.get_results(runner, workers)
+        finally:
+            shutil.rmtree(private_data_dir, ignore_errors=True)
+
+        print()
+        print(tabulate(sorted(results, key=lambda result: (result[2], result[0], result[1])),
+                       headers=["Target", "Technique", "Start (UTC)", "End (UTC)", "Duration", "Status"]))
+        print()
+
+    def get_results(self, runner, workers) -> list:
+        # a worker runs its techniques one after another, so the n-th result of the run task is its n-th technique
+        runs = {worker: [] for worker in workers}
+        for event in runner.events:
+            if event.get('event') not in ('runner_on_ok', 'runner_on_failed', 'runner_on_unreachable'):
+                continue
+            event_data = event['event_data']
+            if event['event'] != 'runner_on_ok':
+                self.log_failure(event_data, event['event'] == 'runner_on_unreachable')
+            if event_data.get('task') == RUN_TASK and event_data.get('host') in runs:
+                runs[event_data['host']].append(event)
+
+        results = []
+        for worker, worker_vars in workers.items():
+            for i, technique in enumerate(worker_vars['techniques']):
+                if i >= len(runs[worker]):
+                    results.append([worker_vars['art_host'], technique, '', '', '', 'not run'])
+                    continue
+                event = runs[worker][i]
+                event_data = event['event_data']
+                results.append([
+                    worker_vars['art_host'],
+                    technique,
+                    self.format_time(event_data.get('start')),
+                    self.format_time(event_data.get('end')),
+                    '%.1fs' % event_data['duration'] if event_data.get('duration') is not None else '',
+                    {'runner_on_ok': 'successful', 'runner_on_failed': 'failed'}.get(event['event'], 'unreachable')
+                ])
+        return results
+
+    def log_failure(self, event_data, unreachable) -> None:
+        res = event_data.get('res') or {}
+        message = res.get('stderr') or res.get('msg') or 'no output'
+        # failed prerequisites and techniques are ignored by the role and only reported, the run continues
+        logging.getLogger('attack_range').log(
+            logging.WARNING if event_data.get('ignore_errors') else logging.ERROR,
+            "%s on %s: %s - %s", 'unreachable' if unreachable else 'failed', event_data.get('host'),
+            event_data.get('task'), message.strip())
+
+    def format_time(self, timestamp) -> str:
+        # the runner serializes the timing of an event as iso timestamp with microseconds
+        if not timestamp:
+            return ''
+        return datetime.fromisoformat(timestamp).isoformat(timespec='seconds')
+
+    def get_host_vars(self, target) -> dict:
+        if self.config['general']['cloud_provider'] == 'aws':
+            target_public_ip = aws_service.get_single_instance_public_ip(target, self.config['general']['key_name'], self.config['general']['attack_range_name'], self.config['aws']['region'])
+            private_key_path = os.path.abspath(os.path.expanduser(self.config['aws']['private_key_path']))
+            windows_user = 'Administrator'
+            windows_port = 5985
+            linux_user = 'ubuntu'
+            linux_port = 22
+
+        elif self.config['general']['cloud_provider'] == 'azure':
+            target_public_ip = azure_service.get_instance_public_ip(target, self.config['general']['key_name'], self.config['general']['attack_range_name'], self.config['azure']['location'])
+            private_key_path = os.path.abspath(os.path.expanduser(self.config['azure']['private_key_path']))
+            windows_user = 'AzureAdmin'
+            windows_port = 5985
+            linux_user = 'ubuntu'
+            linux_port = 22
+
+        elif self.config['general']['cloud_provider'] == 'local':
+            target_public_ip = '192.168.56.' + str(14 + int(target[-1]))
+            private_key_path = os.path.abspath('vagrant/.vagrant/machines/' + target + '/virtualbox/private_key')
+            windows_user = 'Administrator'
+            windows_port = 5985 + int(target[-1])
+            linux_user = 'vagrant'
+            linux_port = 2022 + int(target[-1])
+
+        if "win" in target:
+            return {
+                'ansible_host': target_public_ip,
+                'ansible_port': windows_port,
+                'ansible_connection': 'winrm',
+                'ansible_winrm_server_cert_validation': 'ignore',
+                'ansible_user': windows_user,
+                'ansible_password': self.config['general']['attack_range_password']
+            }
 
-        shutil.rmtree(os.path.join(os.path.dirname(__file__), '../artifacts'))
-        shutil.rmtree(os.path.join(os.path.dirname(__file__), '../env'))
\ No newline at end of file
+        return {
+            'ansible_host': target_public_ip,
+            'ansible_port': linux_port,
+            'ansible_user': linux_user,
+            'ansible_ssh_private_key_file': private_key_path,
+            'ansible_python_interpreter': '/usr/bin/python3'
+        }
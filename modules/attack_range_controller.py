@@ -1,7 +1,7 @@
 import abc
 import os
 
-from modules import logger
+from modules import logger, hec_replay
 
 
 class AttackRangeController(abc.ABC):
@@ -23,15 +23,15 @@ class AttackRangeController(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def stop(self) -> None:
+    def stop(self, instances_ids=None, wait=False) -> None:
         pass
 
     @abc.abstractmethod
-    def resume(self) -> None:
+    def resume(self, instances_ids=None, wait=False) -> None:
         pass
 
     @abc.abstractmethod
-    def simulate(self, engine, target, technique, playbook) -> None:
+    def simulate(self, engine, target, technique, playbook, host_concurrency=1) -> None:
         pass
 
     @abc.abstractmethod
@@ -39,11 +39,35 @@ class AttackRangeController(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def dump(self, dump_name, search, earliest, latest) -> None:
+    def dump(self, dump_name, search, earliest, latest, compress=False, slices=1, checkpoint=False,
+             checkpoint_interval=3600) -> None:
         pass
 
     @abc.abstractmethod
-    def replay(self, file_name, index, sourcetype, source) -> None:
+    def replay(self, file_name, index, sourcetype, source, update_timestamp=False, workers=1, engine="oneshot",
+               batch_size=1000, concurrency=4, compress=False, rate=None, speed=None) -> None:
+        pass
+
+    def replay_manifest(self, manifest, index, update_timestamp=False, batch_size=1000, concurrency=4,
+                        compress=False, parallel_files=4, rate=None, speed=None) -> None:
+        # manifests are always replayed through the HTTP Event Collector, parallel_files datasets at a time
+        hec_replay.replay_manifest(
+            self.get_splunk_ip(),
+            self.config['general']['attack_range_password'],
+            os.path.join(os.path.dirname(__file__), '../'),
+            hec_replay.load_manifest(manifest, index),
+            update_timestamp=update_timestamp,
+            batch_size=batch_size,
+            concurrency=concurrency,
+            compress=compress,
+            parallel_files=parallel_files,
+            logger=self.logger,
+            rate=rate,
+            speed=speed
+        )
+
+    @abc.abstractmethod
+    def get_splunk_ip(self) -> str:
         pass
 
     @abc.abstractmethod
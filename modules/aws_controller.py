@@ -7,7 +7,8 @@ import yaml
 import json
 
 from python_terraform import Terraform, IsNotFlagged
-from modules import aws_service, splunk_sdk
+from modules import aws_service, splunk_sdk, hec_replay, inventory_cache, art_cache
+from modules.DataManipulation import DataManipulation
 from tabulate import tabulate
 from jinja2 import Environment, FileSystemLoader
 from pathlib import Path
@@ -97,15 +98,52 @@ class AwsController(AttackRangeController):
         )
         os.system("cd " + cwd)
 
+        if self.config["simulation"]["atomic_red_team_cache"] == "1":
+            self.config["simulation"]["atomic_red_team_archive"] = art_cache.get_atomics_archive(
+                self.config["simulation"]["atomic_red_team_repo"],
+                self.config["simulation"]["atomic_red_team_branch"],
+                self.logger,
+            )
+
         return_code, stdout, stderr = self.terraform.apply(
             capture_output="yes", skip_plan=True, no_color=IsNotFlagged
         )
 
+        aws_service.invalidate_inventory(self.config["aws"]["region"])
         if not return_code:
             self.logger.info("attack_range has been built using terraform successfully")
-
+            self.update_inventory_cache()
+        else:
+            # a partly applied range is looked up again by the next command
+            inventory_cache.clear_inventory(
+                "aws",
+                self.config["aws"]["region"],
+                self.config["general"]["key_name"],
+                self.config["general"]["attack_range_name"],
+            )
         self.show()
 
+    def update_inventory_cache(self) -> None:
+        state_args = []
+        if self.config["aws"]["use_remote_state"] != "1":
+            state_args.append(self.config["general"]["statepath"])
+        return_code, stdout, stderr = self.terraform.cmd("show", "-json", *state_args)
+        if return_code:
+            inventory_cache.clear_inventory(
+                "aws",
+                self.config["aws"]["region"],
+                self.config["general"]["key_name"],
+                self.config["general"]["attack_range_name"],
+            )
+            return
+        inventory_cache.write_inventory(
+            "aws",
+            self.config["aws"]["region"],
+            self.config["general"]["key_name"],
+            self.config["general"]["attack_range_name"],
+            inventory_cache.instances_from_terraform_state(json.loads(stdout)),
+        )
+
     def destroy(self) -> None:
         self.logger.info("[action] > destroy\n")
 
@@ -124,9 +162,15 @@ class AwsController(AttackRangeController):
             auto_approve=True,
         )
 
+        inventory_cache.clear_inventory(
+            "aws",
+            self.config["aws"]["region"],
+            self.config["general"]["key_name"],
+            self.config["general"]["attack_range_name"],
+        )
         self.logger.info("attack_range has been destroy using terraform successfully")
 
-    def stop(self, instances_ids=None) -> None:
+    def stop(self, instances_ids=None, wait=False) -> None:
         instances = []
         if instances_ids is None:
             instances = aws_service.get_all_instances(
@@ -142,11 +186,21 @@ class AwsController(AttackRangeController):
                 self.config["general"]["attack_range_name"],
                 self.config["aws"]["region"],
             )
-        aws_service.change_ec2_state(
-            instances, "stopped", self.logger, self.config["aws"]["region"]
+        inventory_cache.clear_inventory(
+            "aws",
+            self.config["aws"]["region"],
+            self.config["general"]["key_name"],
+            self.config["general"]["attack_range_name"],
+        )
+        results = aws_service.change_ec2_state(
+            instances, "stopped", self.logger, self.config["aws"]["region"], wait=wait
         )
+        if wait:
+            print()
+            print(tabulate(results, headers=["Name", "Instance ID", "Status", "Time to stopped"]))
+            print()
 
-    def resume(self, instances_ids=None) -> None:
+    def resume(self, instances_ids=None, wait=False) -> None:
         instances = []
         if instances_ids is None:
             instances = aws_service.get_all_instances(
@@ -162,15 +216,25 @@ class AwsController(AttackRangeController):
                 self.config["general"]["attack_range_name"],
                 self.config["aws"]["region"],
             )
-        aws_service.change_ec2_state(
-            instances, "running", self.logger, self.config["aws"]["region"]
+        inventory_cache.clear_inventory(
+            "aws",
+            self.config["aws"]["region"],
+            self.config["general"]["key_name"],
+            self.config["general"]["attack_range_name"],
+        )
+        results = aws_service.change_ec2_state(
+            instances, "running", self.logger, self.config["aws"]["region"], wait=wait
         )
+        if wait:
+            print()
+            print(tabulate(results, headers=["Name", "Instance ID", "Status", "Time to running", "Time to usable"]))
+            print()
 
-    def simulate(self, engine, target, technique, playbook) -> None:
+    def simulate(self, engine, target, technique, playbook, host_concurrency=1) -> None:
         self.logger.info("[action] > simulate\n")
         if engine == "ART":
             simulation_controller = ArtSimulationController(self.config)
-            simulation_controller.simulate(target, technique)
+            simulation_controller.simulate(target, technique, host_concurrency)
         if engine == "PurpleSharp":
             simulation_controller = PurplesharpSimulationController(self.config)
             simulation_controller.simulate(target, technique, playbook)
@@ -191,13 +255,13 @@ class AwsController(AttackRangeController):
                 instances_running = True
                 response.append(
                     [
-                        instance["Tags"][0]["Value"],
+                        aws_service.get_instance_name(instance),
                         instance["State"]["Name"],
                         instance["NetworkInterfaces"][0]["Association"]["PublicIp"],
                         instance["InstanceId"],
                     ]
                 )
-                instance_name = instance["Tags"][0]["Value"]
+                instance_name = aws_service.get_instance_name(instance)
                 if instance_name.startswith("ar-splunk"):
                     splunk_ip = instance["NetworkInterfaces"][0]["Association"][
                         "PublicIp"
@@ -329,7 +393,7 @@ class AwsController(AttackRangeController):
                     )
             else:
                 response.append(
-                    [instance["Tags"][0]["Value"], instance["State"]["Name"]]
+                    [aws_service.get_instance_name(instance), instance["State"]["Name"]]
                 )
 
         print()
@@ -352,7 +416,8 @@ class AwsController(AttackRangeController):
         else:
             print("ERROR: Can't find configured Attack Range Instances")
 
-    def dump(self, dump_name, search, earliest, latest) -> None:
+    def dump(self, dump_name, search, earliest, latest, compress=False, slices=1, checkpoint=False,
+             checkpoint_interval=3600) -> None:
         self.logger.info("Dump log data")
         dump_search = (
             "search "
@@ -364,29 +429,60 @@ class AwsController(AttackRangeController):
             + " | sort 0 _time"
         )
         self.logger.info("Dumping Splunk Search: " + dump_search)
-        out = open(os.path.join(os.path.dirname(__file__), "../" + dump_name), "wb")
-
-        splunk_instance = (
-            "ar-splunk-"
-            + self.config["general"]["key_name"]
-            + "-"
-            + self.config["general"]["attack_range_name"]
-        )
-        splunk_sdk.export_search(
-            aws_service.get_single_instance_public_ip(
-                splunk_instance,
-                self.config["general"]["key_name"],
-                self.config["general"]["attack_range_name"],
-                self.config["aws"]["region"],
-            ),
-            s=dump_search,
-            password=self.config["general"]["attack_range_password"],
-            out=out,
-        )
-        out.close()
+        dump_path = os.path.join(os.path.dirname(__file__), "../" + dump_name)
+
+        splunk_ip = self.get_splunk_ip()
+        if checkpoint:
+            splunk_sdk.export_search_checkpointed(
+                splunk_ip,
+                search,
+                self.config["general"]["attack_range_password"],
+                "-" + earliest,
+                latest,
+                dump_path,
+                slices=slices,
+                checkpoint_interval=checkpoint_interval,
+                compress=compress,
+                logger=self.logger,
+            )
+        elif slices > 1:
+            out = open(dump_path, "wb")
+            splunk_sdk.export_search_slices(
+                splunk_ip,
+                search,
+                self.config["general"]["attack_range_password"],
+                "-" + earliest,
+                latest,
+                slices,
+                out=out,
+                compress=compress,
+                logger=self.logger,
+            )
+            out.close()
+        else:
+            out = open(dump_path, "wb")
+            splunk_sdk.export_search(
+                splunk_ip,
+                s=dump_search,
+                password=self.config["general"]["attack_range_password"],
+                out=out,
+                compress=compress,
+                logger=self.logger,
+            )
+            out.close()
         self.logger.info("[Completed]")
 
-    def replay(self, file_name, index, sourcetype, source) -> None:
+    def replay(self, file_name, index, sourcetype, source, update_timestamp=False, workers=1, engine="oneshot",
+               batch_size=1000, concurrency=4, compress=False, rate=None, speed=None) -> None:
+        if update_timestamp and engine != "hec":
+            DataManipulation().manipulate_timestamp(
+                os.path.join(os.path.dirname(__file__), "../" + file_name),
+                self.logger,
+                sourcetype,
+                source,
+                workers,
+            )
+
         ansible_vars = {}
         ansible_vars["file_name"] = file_name
         ansible_vars["ansible_user"] = "ubuntu"
@@ -401,26 +497,47 @@ class AwsController(AttackRangeController):
         ansible_vars["source"] = source
         ansible_vars["index"] = index
 
+        splunk_ip = self.get_splunk_ip()
+        if engine == "hec":
+            hec_replay.replay(
+                splunk_ip,
+                self.config["general"]["attack_range_password"],
+                os.path.join(os.path.dirname(__file__), "../" + file_name),
+                index,
+                sourcetype,
+                source,
+                batch_size=batch_size,
+                concurrency=concurrency,
+                compress=compress,
+                logger=self.logger,
+                update_timestamp=update_timestamp,
+                rate=rate,
+                speed=speed,
+            )
+            return
+
+        cmdline = "-i %s, -u %s" % (splunk_ip, ansible_vars["ansible_user"])
+        runner = ansible_runner.run(
+            private_data_dir=os.path.join(os.path.dirname(__file__), "../"),
+            cmdline=cmdline,
+            roles_path=os.path.join(os.path.dirname(__file__), "ansible/roles"),
+            playbook=os.path.join(os.path.dirname(__file__), "ansible/data_replay.yml"),
+            extravars=ansible_vars,
+        )
+
+    def get_splunk_ip(self) -> str:
         splunk_instance = (
             "ar-splunk-"
             + self.config["general"]["key_name"]
             + "-"
             + self.config["general"]["attack_range_name"]
         )
-        splunk_ip = aws_service.get_single_instance_public_ip(
+        return aws_service.get_single_instance_public_ip(
             splunk_instance,
             self.config["general"]["key_name"],
             self.config["general"]["attack_range_name"],
             self.config["aws"]["region"],
         )
-        cmdline = "-i %s, -u %s" % (splunk_ip, ansible_vars["ansible_user"])
-        runner = ansible_runner.run(
-            private_data_dir=os.path.join(os.path.dirname(__file__), "../"),
-            cmdline=cmdline,
-            roles_path=os.path.join(os.path.dirname(__file__), "ansible/roles"),
-            playbook=os.path.join(os.path.dirname(__file__), "ansible/data_replay.yml"),
-            extravars=ansible_vars,
-        )
 
     def create_remote_backend(self, backend_name) -> None:
         if not aws_service.check_s3_bucket(backend_name):
@@ -1,140 +1,362 @@
 
-import boto3
 import sys
 import os
 import json
 import time
+import math
+import threading
+import concurrent.futures
+
+from modules import inventory_cache
+
+
+# connections kept per client, sized for the concurrent waiters and region scans
+CLIENT_POOL_SIZE = 25
+CLIENT_RETRIES = {'max_attempts': 10, 'mode': 'adaptive'}
+# instance ids per start/stop call and polling of the waiters used by --wait
+EC2_BATCH_SIZE = 500
+EC2_WAIT_DELAY = 5
+EC2_WAIT_TIMEOUT = 900
+# images found by ami_available_other_region are remembered for an hour
+AMI_CACHE_TTL = 3600
+AMI_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.attack_range', 'ami_cache.json')
+# copied images are polled with exponential backoff until they are available
+AMI_COPY_TIMEOUT = 1800
+AMI_WAIT_MIN_DELAY = 5
+AMI_WAIT_MAX_DELAY = 60
+# boto3 sessions are not thread safe, so clients are created under a lock and reused afterwards.
+# boto3 is only imported with the first session, as importing it is a large part of the cli startup.
+CLIENT_LOCK = threading.Lock()
+CLIENTS = {}
+SESSION = None
+
+
+def get_session():
+    global SESSION
+    with CLIENT_LOCK:
+        if SESSION is None:
+            import boto3
+            SESSION = boto3.session.Session()
+        return SESSION
+
+
+def get_client_config():
+    from botocore.config import Config
+    return Config(max_pool_connections=CLIENT_POOL_SIZE, retries=CLIENT_RETRIES)
+
+
+def get_client(service, region=None):
+    session = get_session()
+    with CLIENT_LOCK:
+        if ('client', service, region) not in CLIENTS:
+            CLIENTS[('client', service, region)] = session.client(service, region_name=region, config=get_client_config())
+        return CLIENTS[('client', service, region)]
+
+
+def get_resource(service, region=None):
+    session = get_session()
+    with CLIENT_LOCK:
+        if ('resource', service, region) not in CLIENTS:
+            CLIENTS[('resource', service, region)] = session.resource(service, region_name=region, config=get_client_config())
+        return CLIENTS[('resource', service, region)]
 
 
 def check_region(config_region):
-    session = boto3.session.Session()
-    aws_cli_region = session.region_name
+    aws_cli_region = get_session().region_name
     return (aws_cli_region == config_region)
 
 
-def get_all_instances(key_name, ar_name, region):
-    client = boto3.client('ec2', region_name=region)
-    response = client.describe_instances(
+# seconds an instance inventory is reused before ec2 is asked again
+INSTANCE_CACHE_TTL = 30
+# inventories by (key_name, ar_name, region), each is a tuple of fetch time, instances and a name to instance index
+INSTANCE_CACHE = {}
+
+
+def get_instance_name(instance):
+    for tag in instance.get('Tags', []):
+        if tag['Key'] == 'Name':
+            return tag['Value']
+    return ''
+
+
+def get_inventory(key_name, ar_name, region):
+    cached = INSTANCE_CACHE.get((key_name, ar_name, region))
+    if cached and time.time() - cached[0] < INSTANCE_CACHE_TTL:
+        return cached
+
+    client = get_client('ec2', region)
+    paginator = client.get_paginator('describe_instances')
+    pages = paginator.paginate(
         Filters=[
             {
                 'Name': "key-name",
                 'Values': [key_name]
+            },
+            {
+                'Name': "tag:Name",
+                'Values': ["ar-*" + key_name + "*" + ar_name + "*"]
+            },
+            {
+                'Name': "instance-state-name",
+                'Values': ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
             }
         ]
     )
     instances = []
-    for reservation in response['Reservations']:
-        for instance in reservation['Instances']:
-            if instance['State']['Name']!='terminated':
-                if len(instance['Tags']) > 0:
-                    tag_value = instance['Tags'][0]['Value']
-                    if tag_value.startswith('ar-'):
-                        if (key_name in tag_value) and (ar_name in tag_value):
-                            instances.append(instance)
+    for page in pages:
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                tag_value = get_instance_name(instance)
+                if tag_value.startswith('ar-') and (key_name in tag_value) and (ar_name in tag_value):
+                    instances.append(instance)
+
+    inventory = (time.time(), instances, {get_instance_name(instance): instance for instance in instances})
+    INSTANCE_CACHE[(key_name, ar_name, region)] = inventory
+    return inventory
+
+
+def invalidate_inventory(region):
+    for cache_key in [cache_key for cache_key in INSTANCE_CACHE if cache_key[2] == region]:
+        del INSTANCE_CACHE[cache_key]
 
-    return instances
+
+def get_all_instances(key_name, ar_name, region):
+    return list(get_inventory(key_name, ar_name, region)[1])
 
 
 def get_instance_by_name(ec2_name, key_name, ar_name, region):
-    instances = get_all_instances(key_name, ar_name, region)
-    for instance in instances:
-        str = instance['Tags'][0]['Value']
-        if str == ec2_name:
-            return instance
-        
+    return get_inventory(key_name, ar_name, region)[2].get(ec2_name)
+
+
 def get_instances_by_ids(instance_ids, ec2_name, key_name, ar_name, region):
-    instances = get_all_instances(key_name, ar_name, region)
-    result = []
-    for instance in instances:
-        if instance['InstanceId'] in instance_ids:
-            result.append(instance)
-    return result
+    instance_ids = set(instance_ids)
+    return [instance for instance in get_inventory(key_name, ar_name, region)[1]
+            if instance['InstanceId'] in instance_ids]
 
 
 def get_single_instance_public_ip(ec2_name, key_name, ar_name, region):
+    public_ip = inventory_cache.get_public_ip('aws', region, key_name, ar_name, ec2_name)
+    if public_ip:
+        return public_ip
+
+    inventory_cache.write_inventory('aws', region, key_name, ar_name, {
+        get_instance_name(instance): instance['NetworkInterfaces'][0]['Association']['PublicIp']
+        for instance in get_all_instances(key_name, ar_name, region)
+        if instance['State']['Name'] == 'running'
+    })
     instance = get_instance_by_name(ec2_name, key_name, ar_name, region)
     return instance['NetworkInterfaces'][0]['Association']['PublicIp']
 
 
-def change_ec2_state(instances, new_state, log, region):
-    client = boto3.client('ec2', region_name=region)
+def change_ec2_state(instances, new_state, log, region, wait=False, wait_timeout=EC2_WAIT_TIMEOUT):
+    client = get_client('ec2', region)
 
     if len(instances) == 0:
         log.error('No instance passed.')
         sys.exit(1)
 
     if new_state == 'stopped':
-        for instance in instances:
-            if instance['State']['Name'] == 'running':
-                response = client.stop_instances(
-                    InstanceIds=[instance['InstanceId']]
-                )
-                log.info('Successfully stopped instance with ID ' +
-                      instance['InstanceId'] + ' .')
+        instance_ids = [instance['InstanceId'] for instance in instances if instance['State']['Name'] == 'running']
+        for i in range(0, len(instance_ids), EC2_BATCH_SIZE):
+            response = client.stop_instances(
+                InstanceIds=instance_ids[i:i + EC2_BATCH_SIZE]
+            )
+        for instance_id in instance_ids:
+            log.info('Successfully stopped instance with ID ' + instance_id + ' .')
 
     elif new_state == 'running':
-        for instance in instances:
-            if instance['State']['Name'] == 'stopped':
-                response = client.start_instances(
-                    InstanceIds=[instance['InstanceId']]
-                )
-                log.info('Successfully started instance with ID ' + instance['InstanceId'] + ' .')
+        instance_ids = [instance['InstanceId'] for instance in instances if instance['State']['Name'] == 'stopped']
+        for i in range(0, len(instance_ids), EC2_BATCH_SIZE):
+            response = client.start_instances(
+                InstanceIds=instance_ids[i:i + EC2_BATCH_SIZE]
+            )
+        for instance_id in instance_ids:
+            log.info('Successfully started instance with ID ' + instance_id + ' .')
+
+    invalidate_inventory(region)
+
+    if wait:
+        return wait_for_ec2_state(instances, new_state, log, region, wait_timeout)
+
+
+def wait_for_instance(instance, waiter_names, region, wait_timeout, started):
+    client = get_client('ec2', region)
+    timings = []
+    for waiter_name in waiter_names:
+        remaining = max(wait_timeout - (time.time() - started), EC2_WAIT_DELAY)
+        client.get_waiter(waiter_name).wait(
+            InstanceIds=[instance['InstanceId']],
+            WaiterConfig={
+                'Delay': EC2_WAIT_DELAY,
+                'MaxAttempts': int(math.ceil(remaining / EC2_WAIT_DELAY))
+            }
+        )
+        timings.append(time.time() - started)
+    return timings
+
+
+def wait_for_ec2_state(instances, new_state, log, region, wait_timeout=EC2_WAIT_TIMEOUT):
+    # running instances are usable once their status checks pass, which is what simulate needs
+    if new_state == 'running':
+        waiter_names = ['instance_running', 'instance_status_ok']
+    else:
+        waiter_names = ['instance_stopped']
+
+    log.info('Waiting up to ' + str(wait_timeout) + ' seconds for ' + str(len(instances)) + ' instances to be ' + new_state + '.')
+    started = time.time()
+    results = []
+    failed = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(instances), CLIENT_POOL_SIZE)) as executor:
+        futures = {
+            executor.submit(wait_for_instance, instance, waiter_names, region, wait_timeout, started): instance
+            for instance in instances
+        }
+        for future in concurrent.futures.as_completed(futures):
+            instance = futures[future]
+            try:
+                timings = future.result()
+            except Exception as e:
+                log.error('Instance with ID ' + instance['InstanceId'] + ' did not reach state ' + new_state + ': ' + str(e))
+                failed = True
+                continue
+            results.append([get_instance_name(instance), instance['InstanceId'], new_state] + ['%.1fs' % timing for timing in timings])
+            log.info('Instance with ID ' + instance['InstanceId'] + ' is ' + new_state + ' after ' + '%.1f' % timings[0] + ' seconds.')
+
+    invalidate_inventory(region)
+
+    if failed:
+        log.error('Not all instances reached state ' + new_state + ' within ' + str(wait_timeout) + ' seconds.')
+        sys.exit(1)
 
+    return sorted(results)
 
-def ami_available(ami_name, region):
-    client = boto3.client('ec2', region_name=region)
+
+def find_image(ami_name, region, states=['available']):
+    client = get_client('ec2', region)
     try:
-        images = client.describe_images(Owners=['self'])
+        images = client.describe_images(
+            Owners=['self'],
+            Filters=[
+                {
+                    'Name': 'name',
+                    'Values': [ami_name]
+                },
+                {
+                    'Name': 'state',
+                    'Values': states
+                }
+            ]
+        )
     except:
-        return False
+        return None
 
     for image in images["Images"]:
-        if 'Name' in image:
-            if ami_name == image["Name"]:
-                if image["State"] == "available":
-                    return True
+        if image.get('Name') == ami_name:
+            return image
 
-    return False
+    return None
 
 
-def ami_available_other_region(ami_name):
-    regions = [
-        "us-east-1", 
-        "us-east-2", 
-        "us-west-1", 
-        "us-west-2", 
-        "ca-central-1", 
-        "eu-west-1", 
-        "eu-west-2", 
-        "eu-central-1", 
-        "ap-southeast-1", 
-        "ap-southeast-2", 
-        "ap-south-1", 
-        "ap-northeast-1", 
-        "ap-northeast-2", 
-        "sa-east-1", 
-        "cn-north-1"
-    ]
+def ami_available(ami_name, region):
+    return find_image(ami_name, region) is not None
+
+
+def get_regions(config_region):
+    from botocore.exceptions import BotoCoreError, ClientError
+    # describe_regions needs a region itself, which machines without a default aws region only have from the config
+    try:
+        client = get_client('ec2', config_region)
+        response = client.describe_regions(
+            Filters=[
+                {
+                    'Name': 'opt-in-status',
+                    'Values': ['opt-in-not-required', 'opted-in']
+                }
+            ]
+        )
+    except (BotoCoreError, ClientError):
+        return [config_region] if config_region else []
+    return [region['RegionName'] for region in response['Regions']]
 
-    for region in regions:
-        if ami_available(ami_name, region):
-            return {"region": region, "image_id": get_image_id(ami_name, region)}
 
-    return {}
+def read_ami_cache():
+    try:
+        with open(AMI_CACHE_PATH, 'r') as cache_file:
+            return json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_ami_cache(cache):
+    os.makedirs(os.path.dirname(AMI_CACHE_PATH), exist_ok=True)
+    tmp_path = AMI_CACHE_PATH + '.tmp'
+    with open(tmp_path, 'w') as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(tmp_path, AMI_CACHE_PATH)
+
+
+def ami_available_other_region(ami_name, regions=None, config_region=None):
+    cache = read_ami_cache()
+    cached = cache.get(ami_name)
+    if cached and time.time() - cached['time'] < AMI_CACHE_TTL:
+        return {"region": cached['region'], "image_id": cached['image_id']}
+
+    if not regions:
+        regions = get_regions(config_region)
+    if not regions:
+        return {}
+
+    # the regions are scanned in parallel and the first region which has the image wins
+    result = {}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(len(regions), CLIENT_POOL_SIZE))
+    try:
+        futures = {executor.submit(find_image, ami_name, region): region for region in regions}
+        for future in concurrent.futures.as_completed(futures):
+            image = future.result()
+            if image:
+                result = {"region": futures[future], "image_id": image["ImageId"]}
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if result:
+        cache[ami_name] = dict(result, time=time.time())
+        write_ami_cache(cache)
 
+    return result
 
 
 def get_image_id(ami_name, region):
-    client = boto3.client('ec2', region_name=region)
-    images = client.describe_images(Owners=['self'])
-
-    for ami in images["Images"]:
-        if ami_name == ami["Name"]:
-            return ami["ImageId"]
+    image = find_image(ami_name, region, states=['pending', 'available'])
+    if image:
+        return image["ImageId"]
+
+
+def wait_for_image(ami_name, image_id, region, timeout=AMI_COPY_TIMEOUT):
+    client = get_client('ec2', region)
+    started = time.time()
+    delay = AMI_WAIT_MIN_DELAY
+    while True:
+        try:
+            images = client.describe_images(ImageIds=[image_id])["Images"]
+        except Exception as e:
+            # a freshly copied image id is not always visible right away
+            images = []
+        state = images[0]["State"] if images else "unknown"
+        elapsed = time.time() - started
+        if state == "available":
+            print("Image " + ami_name + " is available in region " + region + " after " + str(int(elapsed)) + " seconds.")
+            return True
+        if state in ("failed", "error", "invalid", "deregistered") or elapsed >= timeout:
+            print("Error: Image " + ami_name + " in region " + region + " is " + state + " after " + str(int(elapsed)) + " seconds.")
+            return False
+        print("Image " + ami_name + " in region " + region + " is " + state + " after " + str(int(elapsed)) + " seconds.")
+        time.sleep(min(delay, timeout - elapsed))
+        delay = min(delay * 2, AMI_WAIT_MAX_DELAY)
 
 
-def copy_image(ami_name, ami_image_id, source_region, dest_region):
-    session = boto3.client('ec2',region_name=dest_region)
+def start_image_copy(ami_name, ami_image_id, source_region, dest_region):
+    session = get_client('ec2', dest_region)
 
     response = session.copy_image(
         Name=ami_name,
@@ -142,20 +364,44 @@ def copy_image(ami_name, ami_image_id, source_region, dest_region):
         SourceImageId=ami_image_id,
         SourceRegion=source_region
     )
+    return response['ImageId']
 
-    for x in range(0, 10):
-        if ami_available(ami_name, dest_region):
-            break
-        print("Image not yet available. " + str(10-x) + " tries left.")
-        time.sleep(60)
 
-    if not ami_available(ami_name, dest_region):
+def copy_image(ami_name, ami_image_id, source_region, dest_region, timeout=AMI_COPY_TIMEOUT):
+    image_id = start_image_copy(ami_name, ami_image_id, source_region, dest_region)
+
+    if not wait_for_image(ami_name, image_id, dest_region, timeout):
         print("Error: Copying of AMI took longer as expected.")
         sys.exit(1)
 
 
+def copy_images(images, dest_regions, timeout=AMI_COPY_TIMEOUT):
+    # images are (ami_name, ami_image_id, source_region) tuples, every image is copied to every region
+    copies = {}
+    for ami_name, ami_image_id, source_region in images:
+        for dest_region in dest_regions:
+            if dest_region != source_region:
+                copies[(ami_name, dest_region)] = start_image_copy(ami_name, ami_image_id, source_region, dest_region)
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(min(len(copies), CLIENT_POOL_SIZE), 1)) as executor:
+        futures = {
+            executor.submit(wait_for_image, ami_name, image_id, dest_region, timeout): (ami_name, dest_region)
+            for (ami_name, dest_region), image_id in copies.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            if not future.result():
+                failed.append(futures[future])
+
+    if failed:
+        print("Error: Copying of AMIs " + ", ".join(ami_name + " to " + region for ami_name, region in sorted(failed)) + " failed.")
+        sys.exit(1)
+
+    return copies
+
+
 def check_s3_bucket(bucket_name):
-    client = boto3.client('s3')
+    client = get_client('s3')
     some_binary_data = b'Here we have some data'
 
     try:
@@ -168,7 +414,7 @@ def check_s3_bucket(bucket_name):
 
 
 def create_s3_bucket(bucket_name, region, logger):
-    client = boto3.client("s3", region_name=region)
+    client = get_client("s3", region)
     location = {'LocationConstraint': region}
     
     try:
@@ -182,7 +428,7 @@ def create_s3_bucket(bucket_name, region, logger):
 
 
 def create_dynamoo_db(name, region, logger):
-    client = boto3.client('dynamodb', region_name=region)
+    client = get_client('dynamodb', region)
     try:
         response = client.create_table(
             TableName=name,
@@ -215,7 +461,7 @@ def create_dynamoo_db(name, region, logger):
 
 
 def delete_s3_bucket(bucket_name, region, logger):
-    s3 = boto3.resource('s3', region_name=region)
+    s3 = get_resource('s3', region)
     try:
         bucket = s3.Bucket(bucket_name)
         bucket.objects.all().delete()
@@ -228,7 +474,7 @@ def delete_s3_bucket(bucket_name, region, logger):
 
 
 def delete_dynamo_db(name, region, logger):
-    dynamodb = boto3.resource('dynamodb', region_name=region)
+    dynamodb = get_resource('dynamodb', region)
     try:
         table = dynamodb.Table(name)
         table.delete()
@@ -240,7 +486,7 @@ def delete_dynamo_db(name, region, logger):
 
 
 def check_secret_exists(name):
-    client = boto3.client('secretsmanager')
+    client = get_client('secretsmanager')
     response = client.list_secrets()
     for secret in response['SecretList']:
         if secret['Name'] == str(name + '-key'):
@@ -250,7 +496,7 @@ def check_secret_exists(name):
 
 
 def create_secret(name, value, config, logger):
-    client = boto3.client('secretsmanager')
+    client = get_client('secretsmanager')
     key_name = name + '-key'
     config_name = name + '-config'
     try:
@@ -271,7 +517,7 @@ def create_secret(name, value, config, logger):
 
 
 def get_secret_key(name, logger):
-    client = boto3.client('secretsmanager')
+    client = get_client('secretsmanager')
 
     response = client.get_secret_value(
         SecretId=name + '-key'
@@ -283,7 +529,7 @@ def get_secret_key(name, logger):
 
 
 def get_secret_config(name, logger):
-    client = boto3.client('secretsmanager')
+    client = get_client('secretsmanager')
     
     response = client.get_secret_value(
         SecretId=name + '-config'
@@ -293,7 +539,7 @@ def get_secret_config(name, logger):
 
 
 def delete_secret(name, logger):
-    client = boto3.client('secretsmanager')
+    client = get_client('secretsmanager')
 
     try:
         response = client.delete_secret(
@@ -312,8 +558,7 @@ def delete_secret(name, logger):
 
 
 def create_key_pair(name, region, logger):
-    aws_session = boto3.Session()
-    client = aws_session.client('ec2', region_name=region)
+    client = get_client('ec2', region)
 
     response = client.create_key_pair(KeyName=name)
     ssh_key_name = name + ".key"
@@ -327,5 +572,5 @@ def create_key_pair(name, region, logger):
 
 
 def delete_key_pair(name, region, logger):
-    ec2 = boto3.client('ec2', region_name=region)
+    ec2 = get_client('ec2', region)
     response = ec2.delete_key_pair(KeyName=name)
@@ -8,7 +8,8 @@ import json
 from python_terraform import Terraform, IsNotFlagged
 from tabulate import tabulate
 
-from modules import azure_service, splunk_sdk
+from modules import azure_service, splunk_sdk, hec_replay, inventory_cache, art_cache
+from modules.DataManipulation import DataManipulation
 from modules.attack_range_controller import AttackRangeController
 from modules.art_simulation_controller import ArtSimulationController
 from modules.purplesharp_simulation_controller import PurplesharpSimulationController
@@ -86,14 +87,47 @@ class AzureController(AttackRangeController):
         )
         os.system("cd " + cwd)
 
+        if self.config["simulation"]["atomic_red_team_cache"] == "1":
+            self.config["simulation"]["atomic_red_team_archive"] = art_cache.get_atomics_archive(
+                self.config["simulation"]["atomic_red_team_repo"],
+                self.config["simulation"]["atomic_red_team_branch"],
+                self.logger,
+            )
+
         return_code, stdout, stderr = self.terraform.apply(
             capture_output="yes", skip_plan=True, no_color=IsNotFlagged
         )
         if not return_code:
             self.logger.info("attack_range has been built using terraform successfully")
-
+            self.update_inventory_cache()
+        else:
+            # a partly applied range is looked up again by the next command
+            inventory_cache.clear_inventory(
+                "azure",
+                self.config["azure"]["location"],
+                self.config["general"]["key_name"],
+                self.config["general"]["attack_range_name"],
+            )
         self.show()
 
+    def update_inventory_cache(self) -> None:
+        return_code, stdout, stderr = self.terraform.cmd("show", "-json", self.config["general"]["statepath"])
+        if return_code:
+            inventory_cache.clear_inventory(
+                "azure",
+                self.config["azure"]["location"],
+                self.config["general"]["key_name"],
+                self.config["general"]["attack_range_name"],
+            )
+            return
+        inventory_cache.write_inventory(
+            "azure",
+            self.config["azure"]["location"],
+            self.config["general"]["key_name"],
+            self.config["general"]["attack_range_name"],
+            inventory_cache.instances_from_terraform_state(json.loads(stdout)),
+        )
+
     def destroy(self) -> None:
         self.logger.info("[action] > destroy\n")
         return_code, stdout, stderr = self.terraform.destroy(
@@ -102,29 +136,59 @@ class AzureController(AttackRangeController):
             force=IsNotFlagged,
             auto_approve=True,
         )
+        inventory_cache.clear_inventory(
+            "azure",
+            self.config["azure"]["location"],
+            self.config["general"]["key_name"],
+            self.config["general"]["attack_range_name"],
+        )
         self.logger.info("attack_range has been destroy using terraform successfully")
 
-    def stop(self) -> None:
-        azure_service.change_instance_state(
+    def stop(self, instances_ids=None, wait=False) -> None:
+        inventory_cache.clear_inventory(
+            "azure",
+            self.config["azure"]["location"],
+            self.config["general"]["key_name"],
+            self.config["general"]["attack_range_name"],
+        )
+        results = azure_service.change_instance_state(
             self.config["general"]["key_name"],
             self.config["general"]["attack_range_name"],
             "stopped",
             self.logger,
+            wait=wait,
+            instance_names=instances_ids,
         )
+        if wait:
+            print()
+            print(tabulate(results, headers=["Name", "Status", "Time to stopped"]))
+            print()
 
-    def resume(self) -> None:
-        azure_service.change_instance_state(
+    def resume(self, instances_ids=None, wait=False) -> None:
+        inventory_cache.clear_inventory(
+            "azure",
+            self.config["azure"]["location"],
+            self.config["general"]["key_name"],
+            self.config["general"]["attack_range_name"],
+        )
+        results = azure_service.change_instance_state(
             self.config["general"]["key_name"],
             self.config["general"]["attack_range_name"],
             "running",
             self.logger,
+            wait=wait,
+            instance_names=instances_ids,
         )
+        if wait:
+            print()
+            print(tabulate(results, headers=["Name", "Status", "Time to running"]))
+            print()
 
-    def simulate(self, engine, target, technique, playbook) -> None:
+    def simulate(self, engine, target, technique, playbook, host_concurrency=1) -> None:
         self.logger.info("[action] > simulate\n")
         if engine == "ART":
             simulation_controller = ArtSimulationController(self.config)
-            simulation_controller.simulate(target, technique)
+            simulation_controller.simulate(target, technique, host_concurrency)
         elif engine == "PurpleSharp":
             simulation_controller = PurplesharpSimulationController(self.config)
             simulation_controller.simulate(target, technique, playbook)
@@ -253,7 +317,8 @@ class AzureController(AttackRangeController):
         else:
             print("ERROR: Can't find configured Attack Range Instances")
 
-    def dump(self, dump_name, search, earliest, latest) -> None:
+    def dump(self, dump_name, search, earliest, latest, compress=False, slices=1, checkpoint=False,
+             checkpoint_interval=3600) -> None:
         self.logger.info("Dump log data")
         dump_search = (
             "search "
@@ -265,28 +330,60 @@ class AzureController(AttackRangeController):
             + " | sort 0 _time"
         )
         self.logger.info("Dumping Splunk Search: " + dump_search)
-        out = open(os.path.join(os.path.dirname(__file__), "../" + dump_name), "wb")
+        dump_path = os.path.join(os.path.dirname(__file__), "../" + dump_name)
 
-        splunk_instance = (
-            "ar-splunk-"
-            + self.config["general"]["key_name"]
-            + "-"
-            + self.config["general"]["attack_range_name"]
-        )
-        splunk_sdk.export_search(
-            azure_service.get_instance(
-                splunk_instance,
-                self.config["general"]["key_name"],
-                self.config["general"]["attack_range_name"],
-            )["public_ip"],
-            s=dump_search,
-            password=self.config["general"]["attack_range_password"],
-            out=out,
-        )
-        out.close()
+        splunk_ip = self.get_splunk_ip()
+        if checkpoint:
+            splunk_sdk.export_search_checkpointed(
+                splunk_ip,
+                search,
+                self.config["general"]["attack_range_password"],
+                "-" + earliest,
+                latest,
+                dump_path,
+                slices=slices,
+                checkpoint_interval=checkpoint_interval,
+                compress=compress,
+                logger=self.logger,
+            )
+        elif slices > 1:
+            out = open(dump_path, "wb")
+            splunk_sdk.export_search_slices(
+                splunk_ip,
+                search,
+                self.config["general"]["attack_range_password"],
+                "-" + earliest,
+                latest,
+                slices,
+                out=out,
+                compress=compress,
+                logger=self.logger,
+            )
+            out.close()
+        else:
+            out = open(dump_path, "wb")
+            splunk_sdk.export_search(
+                splunk_ip,
+                s=dump_search,
+                password=self.config["general"]["attack_range_password"],
+                out=out,
+                compress=compress,
+                logger=self.logger,
+            )
+            out.close()
         self.logger.info("[Completed]")
 
-    def replay(self, file_name, index, sourcetype, source) -> None:
+    def replay(self, file_name, index, sourcetype, source, update_timestamp=False, workers=1, engine="oneshot",
+               batch_size=1000, concurrency=4, compress=False, rate=None, speed=None) -> None:
+        if update_timestamp and engine != "hec":
+            DataManipulation().manipulate_timestamp(
+                os.path.join(os.path.dirname(__file__), "../" + file_name),
+                self.logger,
+                sourcetype,
+                source,
+                workers,
+            )
+
         ansible_vars = {}
         ansible_vars["file_name"] = file_name
         ansible_vars["ansible_user"] = "ubuntu"
@@ -301,24 +398,46 @@ class AzureController(AttackRangeController):
         ansible_vars["source"] = source
         ansible_vars["index"] = index
 
+        splunk_ip = self.get_splunk_ip()
+        if engine == "hec":
+            hec_replay.replay(
+                splunk_ip,
+                self.config["general"]["attack_range_password"],
+                os.path.join(os.path.dirname(__file__), "../" + file_name),
+                index,
+                sourcetype,
+                source,
+                batch_size=batch_size,
+                concurrency=concurrency,
+                compress=compress,
+                logger=self.logger,
+                update_timestamp=update_timestamp,
+                rate=rate,
+                speed=speed,
+            )
+            return
+
+        cmdline = "-i %s, -u %s" % (splunk_ip, ansible_vars["ansible_user"])
+        runner = ansible_runner.run(
+            private_data_dir=os.path.join(os.path.dirname(__file__), "../"),
+            cmdline=cmdline,
+            roles_path=os.path.join(os.path.dirname(__file__), "ansible/roles"),
+            playbook=os.path.join(os.path.dirname(__file__), "ansible/data_replay.yml"),
+            extravars=ansible_vars,
+        )
+
+    def get_splunk_ip(self) -> str:
         splunk_instance = (
             "ar-splunk-"
             + self.config["general"]["key_name"]
             + "-"
             + self.config["general"]["attack_range_name"]
         )
-        splunk_ip = azure_service.get_instance(
+        return azure_service.get_instance_public_ip(
             splunk_instance,
             self.config["general"]["key_name"],
             self.config["general"]["attack_range_name"],
-        )["public_ip"]
-        cmdline = "-i %s, -u %s" % (splunk_ip, ansible_vars["ansible_user"])
-        runner = ansible_runner.run(
-            private_data_dir=os.path.join(os.path.dirname(__file__), "../"),
-            cmdline=cmdline,
-            roles_path=os.path.join(os.path.dirname(__file__), "ansible/roles"),
-            playbook=os.path.join(os.path.dirname(__file__), "ansible/data_replay.yml"),
-            extravars=ansible_vars,
+            self.config["azure"]["location"],
         )
 
     def create_remote_backend(self, backend_name) -> None:
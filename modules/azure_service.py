@@ -1,26 +1,79 @@
 import sys
 import os
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.compute import ComputeManagementClient
-from azure.identity import AzureCliCredential
-from azure.mgmt.network import NetworkManagementClient
+import time
+import threading
+import importlib
+import concurrent.futures
 
+from modules import inventory_cache
+
+
+# AzureCliCredential shells out to the az cli for every new token, so the credential and clients are shared.
+# The azure packages are only imported with the first client, as importing them is a large part of the cli startup.
+CLIENT_LOCK = threading.Lock()
+CLIENTS = {}
+CLIENT_CLASSES = {
+    'resource': ('azure.mgmt.resource', 'ResourceManagementClient'),
+    'compute': ('azure.mgmt.compute', 'ComputeManagementClient'),
+    'network': ('azure.mgmt.network', 'NetworkManagementClient'),
+}
+# seconds stop and resume --wait wait for the start and power off operations
+VM_WAIT_TIMEOUT = 900
+
+
+def get_client(client_name):
+    with CLIENT_LOCK:
+        if 'credential' not in CLIENTS:
+            from azure.identity import AzureCliCredential
+            CLIENTS['credential'] = AzureCliCredential()
+        if client_name not in CLIENTS:
+            module_name, class_name = CLIENT_CLASSES[client_name]
+            client_class = getattr(importlib.import_module(module_name), class_name)
+            CLIENTS[client_name] = client_class(CLIENTS['credential'], os.environ["AZURE_SUBSCRIPTION_ID"])
+        return CLIENTS[client_name]
+
+
+def get_resource_group(key_name, ar_name):
+    return "ar-rg-" + key_name + '-' + ar_name
+
+
+def get_public_ips(resource_group):
+    """
+    get_public_ips function returns the public ip of every vm in the resource group.
+
+    :param resource_group: resource group of the attack range
+    :return: dict of lower case vm id to public IP
+    """
+    network_client = get_client('network')
+    public_ips = {}
+    for public_ip in network_client.public_ip_addresses.list(resource_group):
+        public_ips[public_ip.id.lower()] = public_ip.ip_address
+
+    vm_ips = {}
+    for interface in network_client.network_interfaces.list(resource_group):
+        if interface.virtual_machine is None or not interface.ip_configurations:
+            continue
+        ip_reference = interface.ip_configurations[0].public_ip_address
+        if ip_reference is not None:
+            vm_ips[interface.virtual_machine.id.lower()] = public_ips.get(ip_reference.id.lower())
+    return vm_ips
 
 
 def get_all_instances(key_name, ar_name):
-    credential = AzureCliCredential()
-    subscription_id = os.environ["AZURE_SUBSCRIPTION_ID"]
-    compute_client = ComputeManagementClient(credential, subscription_id)
+    compute_client = get_client('compute')
+    resource_group = get_resource_group(key_name, ar_name)
 
     instances = []
+    vm_ips = None
 
-    for vm in compute_client.virtual_machines.list("ar-rg-" + key_name + '-' + ar_name):
-        vm_extended = compute_client.virtual_machines.get("ar-rg-" + key_name + '-' + ar_name, vm.name, expand='instanceView')
-        if vm_extended.instance_view.statuses[1].display_status not in ["VM deallocating", "VM deallocated"]:
+    for vm in compute_client.virtual_machines.list(resource_group, expand='instanceView'):
+        if vm.instance_view.statuses[1].display_status not in ["VM deallocating", "VM deallocated"]:
             vm_obj = {}
-            if vm_extended.instance_view.statuses[1].display_status == "VM running":
-                vm_obj['public_ip'] = get_public_ip(vm_extended)
-            vm_obj['vm_obj'] = vm_extended
+            if vm.instance_view.statuses[1].display_status == "VM running":
+                if vm_ips is None:
+                    vm_ips = get_public_ips(resource_group)
+                vm_obj['public_ip'] = vm_ips.get(vm.id.lower())
+            vm_obj['vm_obj'] = vm
             instances.append(vm_obj)
 
     return instances
@@ -34,52 +87,98 @@ def get_instance(instance_name, key_name, ar_name):
             return instance
 
 
-def get_public_ip(vm_obj):
-    """
-    get_public_ip function returns the public ip of the vm.
-
-    :param vm_obj: vm to find the public IP for
-    :return: public IP
-    """
-    credential = AzureCliCredential()
-    subscription_id = os.environ["AZURE_SUBSCRIPTION_ID"]
-    network_client = NetworkManagementClient(credential ,subscription_id)
-    interface = vm_obj.network_profile.network_interfaces[0]
-    name=" ".join(interface.id.split('/')[-1:])
-    sub="".join(interface.id.split('/')[4])
-    ip_config=network_client.network_interfaces.get(sub, name).ip_configurations
-    ip_reference = ip_config[0].public_ip_address
-    ip_reference = ip_reference.id.split('/')
-    ip_group = ip_reference[4]
-    ip_name = ip_reference[8]
-    public_ip = network_client.public_ip_addresses.get(ip_group, ip_name)
-    return public_ip.ip_address
-
-
-def change_instance_state(key_name, ar_name, new_state, log):
-    credential = AzureCliCredential()
-    subscription_id = os.environ["AZURE_SUBSCRIPTION_ID"]
-    compute_client = ComputeManagementClient(credential, subscription_id)
+def get_instance_public_ip(instance_name, key_name, ar_name, location):
+    public_ip = inventory_cache.get_public_ip('azure', location, key_name, ar_name, instance_name)
+    if public_ip:
+        return public_ip
 
     instances = get_all_instances(key_name, ar_name)
+    inventory_cache.write_inventory('azure', location, key_name, ar_name, {
+        instance['vm_obj'].name: instance['public_ip'] for instance in instances if instance.get('public_ip')
+    })
+    for instance in instances:
+        if instance['vm_obj'].name == instance_name:
+            return instance['public_ip']
+
 
+def change_instance_state(key_name, ar_name, new_state, log, wait=False, wait_timeout=VM_WAIT_TIMEOUT,
+                          instance_names=None):
+    compute_client = get_client('compute')
+    resource_group = get_resource_group(key_name, ar_name)
+
+    instances = get_all_instances(key_name, ar_name)
+    if instance_names is not None:
+        found = set(instance['vm_obj'].name for instance in instances)
+        missing = [name for name in instance_names if name not in found]
+        if missing:
+            log.error('Instances ' + ', '.join(missing) + ' not found in resource group ' + resource_group + ' or deallocated.')
+            sys.exit(1)
+        instances = [instance for instance in instances if instance['vm_obj'].name in instance_names]
+
+    pollers = {}
     if new_state == 'stopped':
         for instance in instances:
             if instance['vm_obj'].instance_view.statuses[1].display_status == "VM running":
-                async_vm_stop = compute_client.virtual_machines.begin_power_off("ar-rg-" + key_name + '-' + ar_name, instance['vm_obj'].name)
-                log.info('Successfully stopped instance ' + instance['vm_obj'].name + ' .')
+                pollers[instance['vm_obj'].name] = compute_client.virtual_machines.begin_power_off(resource_group, instance['vm_obj'].name)
+                log.info('Stopping instance ' + instance['vm_obj'].name + ' .')
 
     elif new_state == 'running':
         for instance in instances:
             if instance['vm_obj'].instance_view.statuses[1].display_status == "VM stopped":
-                async_vm_start = compute_client.virtual_machines.begin_start("ar-rg-" + key_name + '-' + ar_name, instance['vm_obj'].name)
-                log.info('Successfully started instance ' + instance['vm_obj'].name + ' .')
+                pollers[instance['vm_obj'].name] = compute_client.virtual_machines.begin_start(resource_group, instance['vm_obj'].name)
+                log.info('Starting instance ' + instance['vm_obj'].name + ' .')
+
+    if wait and pollers:
+        return wait_for_pollers(pollers, new_state, log, wait_timeout)
+    return []
+
+
+def wait_for_poller(poller, wait_timeout, started):
+    poller.result(timeout=max(wait_timeout - (time.time() - started), 0))
+    if not poller.done():
+        raise TimeoutError('timed out after ' + str(wait_timeout) + ' seconds')
+    return time.time() - started
+
+
+def wait_for_pollers(pollers, new_state, log, wait_timeout=VM_WAIT_TIMEOUT):
+    """
+    wait_for_pollers function waits for the long running operations of all vms at once.
+
+    :param pollers: dict of vm name to the poller of its start or stop operation
+    :param new_state: state the vms are changed to
+    :param log: logger
+    :param wait_timeout: seconds to wait for all vms
+    :return: list of vm name, new state and seconds it took
+    """
+    log.info('Waiting up to ' + str(wait_timeout) + ' seconds for ' + str(len(pollers)) + ' instances to be ' + new_state + '.')
+    started = time.time()
+    results = []
+    failed = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(pollers)) as executor:
+        futures = {
+            executor.submit(wait_for_poller, poller, wait_timeout, started): name
+            for name, poller in pollers.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                elapsed = future.result()
+            except Exception as e:
+                log.error('Instance ' + name + ' did not reach state ' + new_state + ': ' + str(e))
+                failed = True
+                continue
+            results.append([name, new_state, '%.1fs' % elapsed])
+            log.info('Instance ' + name + ' is ' + new_state + ' after ' + '%.1f' % elapsed + ' seconds.')
+
+    if failed:
+        log.error('Not all instances reached state ' + new_state + ' within ' + str(wait_timeout) + ' seconds.')
+        sys.exit(1)
+
+    return sorted(results)
 
 
 def create_ressource_group(region):
-    credential = AzureCliCredential()
-    subscription_id = os.environ["AZURE_SUBSCRIPTION_ID"]    
-    resource_client = ResourceManagementClient(credential, subscription_id)
+    resource_client = get_client('resource')
     rg_result = resource_client.resource_groups.create_or_update(
         "packer_" + region.replace(" ", "_"),
         {
@@ -89,9 +188,7 @@ def create_ressource_group(region):
 
 
 def check_image_available(ar_image, region):
-    credential = AzureCliCredential()
-    subscription_id = os.environ["AZURE_SUBSCRIPTION_ID"]
-    compute_client = ComputeManagementClient(credential, subscription_id)
+    compute_client = get_client('compute')
 
     rg_name = "packer_" + region.replace(" ", "_")
 
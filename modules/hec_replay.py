@@ -0,0 +1,381 @@
+import os
+import gzip
+import time
+import uuid
+import yaml
+import threading
+import concurrent.futures
+
+import requests
+from tabulate import tabulate
+
+from modules import splunk_sdk
+from modules.DataManipulation import DataManipulation, find_timestamp_shifter, parse_timestamp_with_codecs
+
+
+# port of the Splunk HTTP Event Collector
+HEC_PORT = 8088
+# name of the HEC token created on the Splunk server for replays
+HEC_TOKEN_NAME = "attack_range_replay"
+# a batch is sent once it holds this many bytes, even if it has fewer events than the batch size
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+# in real-time playback the events of a batch span at most this many seconds of playback time
+REALTIME_BATCH_SPAN = 1.0
+
+
+class TokenBucket:
+    """
+    TokenBucket limits the rate of events sent by all threads sharing it. Tokens are refilled at rate per
+    second up to capacity, a batch takes one token per event and waits while the bucket is in debt.
+    The bucket starts empty, so a replay does not begin with a burst.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        """
+        acquire function takes tokens from the bucket and sleeps until the rate allows them.
+
+        :param tokens: number of tokens
+        :return: No return values
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+def get_hec_token(host, password, username="admin", splunk_rest_port=8089, session=None):
+    """
+    Enables the HTTP Event Collector on the Splunk server and returns the token used for replays,
+    the token is created on first use.
+    @param host: splunk server address
+    @param password: Splunk server password
+    @param username: Splunk server username
+    @param splunk_rest_port: Splunk server port
+    @param session: requests session to reuse pooled connections
+    @return: HEC token
+    """
+    import urllib3
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    session = session or requests
+    url = "https://%s:%d/servicesNS/nobody/splunk_httpinput/data/inputs/http" % (host, splunk_rest_port)
+
+    r = session.post(url + "/http/enable", auth=(username, password), verify=False)
+    r.raise_for_status()
+
+    r = session.get(url, auth=(username, password), params={'output_mode': 'json', 'count': 0}, verify=False)
+    r.raise_for_status()
+    for entry in r.json()["entry"]:
+        if entry["name"] == "http://" + HEC_TOKEN_NAME:
+            return entry["content"]["token"]
+
+    r = session.post(url, auth=(username, password), data={'name': HEC_TOKEN_NAME, 'output_mode': 'json'},
+                     verify=False)
+    r.raise_for_status()
+    return r.json()["entry"][0]["content"]["token"]
+
+
+def read_event_time(shifter, line):
+    """
+    Reads the time of the event starting with a line.
+    @param shifter: TimestampShifter object of the events
+    @param line: first line of the event as bytes
+    @return: microseconds since 0001-01-01 or None if the line has no valid timestamp
+    """
+    match = shifter.pattern.search(line)
+    if match is None:
+        return None
+    try:
+        return parse_timestamp_with_codecs(shifter.codecs, match.group(match.lastindex or 0).decode('utf-8'))[0]
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def read_event_batches(path, batch_size, event_start=None, shifter=None, max_span=None):
+    """
+    Reads a file in batches of whole events, a batch only ends in front of a line starting an event.
+    Files ending with .gz are decompressed while they are read.
+    @param path: path of the file
+    @param batch_size: number of events of a batch
+    @param event_start: compiled bytes regex matching the first line of an event, None if every line is an event
+    @param shifter: TimestampShifter object to read the event times with, only needed for max_span
+    @param max_span: microseconds of event time a batch spans at most
+    @return: generator of tuples of batch bytes, number of events and time of the first event or None
+    """
+    batch = []
+    events = 0
+    size = 0
+    first_time = None
+    with (gzip.open if path.endswith(".gz") else open)(path, "rb") as f:
+        for line in f:
+            if event_start.match(line) if event_start else line.strip():
+                event_time = read_event_time(shifter, line) if shifter else None
+                if events >= batch_size or size >= MAX_BATCH_BYTES or (
+                        event_time is not None and first_time is not None and abs(event_time - first_time) > max_span):
+                    yield b"".join(batch), events, first_time
+                    batch = []
+                    events = 0
+                    size = 0
+                    first_time = None
+                events += 1
+                if first_time is None:
+                    first_time = event_time
+            batch.append(line)
+            size += len(line)
+    if batch:
+        yield b"".join(batch), events, first_time
+
+
+def send_batch(session, url, headers, params, batch, compress=False, shift=None):
+    """
+    Sends a batch of raw events to the HTTP Event Collector.
+    @param session: requests session
+    @param url: url of the raw HEC endpoint
+    @param headers: request headers with the HEC token
+    @param params: index, sourcetype and source of the events
+    @param batch: raw events as bytes
+    @param compress: gzip compress the request body
+    @param shift: function shifting the timestamps of the batch
+    """
+    if shift:
+        batch = shift(batch)
+    if compress:
+        batch = gzip.compress(batch, compresslevel=1)
+        headers = dict(headers, **{'Content-Encoding': 'gzip'})
+    r = session.post(url, data=batch, headers=headers, params=params, verify=False)
+    r.raise_for_status()
+
+
+def replay_file(host, token, path, index, sourcetype, source, batch_size=1000, concurrency=4, compress=False,
+                logger=None, hec_port=HEC_PORT, session=None, update_timestamp=False, bucket=None, speed=None):
+    """
+    Streams a file of raw events to the raw endpoint of the HTTP Event Collector in concurrent batches.
+    Splunk breaks and timestamps the events like a oneshot upload of the file. At most twice as many batches
+    as there are concurrent requests are held in memory. With update_timestamp the timestamps of every batch
+    are shifted while it is sent, read, shift, compress and send is a single pass and the file is not modified.
+    The rate is limited by a token bucket, or with speed the events are played back in real time: the time
+    between sending two events is the time between them in the file divided by speed.
+    @param host: splunk server address
+    @param token: HEC token
+    @param path: path of the file
+    @param index: index of the events
+    @param sourcetype: sourcetype of the events
+    @param source: source of the events
+    @param batch_size: number of events sent per request
+    @param concurrency: number of concurrent requests
+    @param compress: gzip compress the requests
+    @param logger: logger object reporting the throughput
+    @param hec_port: port of the HTTP Event Collector
+    @param session: requests session with a connection pool of at least concurrency connections
+    @param update_timestamp: shift the timestamps so that the latest event of the file happens now
+    @param bucket: TokenBucket object limiting the events per second
+    @param speed: play the events back in real time multiplied by speed
+    @return: tuple of number of events and bytes sent
+    """
+    import urllib3
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    own_session = session is None
+    session = session or splunk_sdk.create_session(concurrency, splunk_sdk.EXPORT_RETRIES)
+
+    shifter = find_timestamp_shifter(sourcetype, source)
+    event_start = shifter.event_start if shifter else None
+    if speed and shifter is None:
+        raise ValueError("real-time playback needs event timestamps, no timestamp shifter is registered for "
+                         "sourcetype %s and source %s" % (sourcetype, source))
+    if bucket:
+        # a batch per second at least, so the rate is not reached in bursts
+        batch_size = max(1, min(batch_size, int(bucket.rate)))
+    url = "https://%s:%d/services/collector/raw" % (host, hec_port)
+    headers = {'Authorization': 'Splunk ' + token, 'X-Splunk-Request-Channel': str(uuid.uuid4())}
+    params = {'index': index, 'sourcetype': sourcetype, 'source': source}
+    data_manipulation = DataManipulation()
+    shift = data_manipulation.create_batch_shifter(path, logger, sourcetype, source) if update_timestamp else None
+    if update_timestamp and shift is None and shifter is not None:
+        raise ValueError("can not update the timestamps of %s, no %s timestamp was found in it" % (path, shifter.name))
+
+    started = time.time()
+    events = 0
+    sent = 0
+    pending = set()
+    first_event_time = None
+    last_event_time = None
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for batch, batch_events, batch_time in read_event_batches(
+                    path, batch_size, event_start, shifter if speed else None,
+                    REALTIME_BATCH_SPAN * speed * 1000000 if speed else None):
+                if bucket:
+                    bucket.acquire(batch_events)
+                if speed and batch_time is not None:
+                    if first_event_time is None:
+                        first_event_time = batch_time
+                    last_event_time = batch_time
+                    delay = started + abs(batch_time - first_event_time) / 1000000.0 / speed - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                if len(pending) >= 2 * concurrency:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(send_batch, session, url, headers, params, batch, compress, shift))
+                events += batch_events
+                sent += len(batch)
+            for future in concurrent.futures.as_completed(pending):
+                future.result()
+    finally:
+        if own_session:
+            session.close()
+
+    if logger:
+        elapsed = time.time() - started
+        logger.info("replayed %d events (%d bytes) of %s in %.1f seconds, %.0f events/s"
+                    % (events, sent, path, elapsed, events / elapsed if elapsed else 0.0))
+        if speed and first_event_time is not None and elapsed:
+            logger.info("played back at %.2fx of real time, requested %.2fx"
+                        % (abs(last_event_time - first_event_time) / 1000000.0 / elapsed, speed))
+        if shift:
+            info = shift.cache_info()
+            data_manipulation.log_timestamp_cache_stats(info.hits, info.misses, logger)
+    return events, sent
+
+
+def replay(host, password, path, index, sourcetype, source, batch_size=1000, concurrency=4, compress=False,
+           logger=None, username="admin", splunk_rest_port=8089, hec_port=HEC_PORT, update_timestamp=False,
+           rate=None, speed=None):
+    """
+    Replays a file of raw events into the Splunk server through the HTTP Event Collector.
+    @param host: splunk server address
+    @param password: Splunk server password
+    @param path: path of the file
+    @param index: index of the events
+    @param sourcetype: sourcetype of the events
+    @param source: source of the events
+    @param batch_size: number of events sent per request
+    @param concurrency: number of concurrent requests
+    @param compress: gzip compress the requests
+    @param logger: logger object reporting the throughput
+    @param username: Splunk server username
+    @param splunk_rest_port: Splunk server port
+    @param hec_port: port of the HTTP Event Collector
+    @param update_timestamp: shift the timestamps so that the latest event of the file happens now
+    @param rate: maximum number of events per second, unlimited by default
+    @param speed: play the events back in real time multiplied by speed
+    @return: tuple of number of events and bytes sent
+    """
+    with splunk_sdk.create_session(concurrency, splunk_sdk.EXPORT_RETRIES) as session:
+        token = get_hec_token(host, password, username, splunk_rest_port, session)
+        started = time.time()
+        events, sent = replay_file(host, token, path, index, sourcetype, source, batch_size, concurrency, compress,
+                                   logger, hec_port, session, update_timestamp, TokenBucket(rate) if rate else None,
+                                   speed)
+    log_achieved_rate(events, time.time() - started, rate, logger)
+    return events, sent
+
+
+def log_achieved_rate(events, elapsed, rate, logger):
+    """
+    Logs the achieved against the requested events per second of a rate limited replay.
+    @param events: number of events sent
+    @param elapsed: seconds the replay took
+    @param rate: requested events per second or None
+    @param logger: logger object
+    """
+    if rate and logger:
+        logger.info("achieved %.0f events/s, requested %.0f events/s" % (events / elapsed if elapsed else 0.0, rate))
+
+
+def load_manifest(manifest_path, index):
+    """
+    Loads a replay manifest, a YAML or JSON list of datasets with the keys file_name, sourcetype, source
+    and optionally index and update_timestamp.
+    @param manifest_path: path of the manifest
+    @param index: index of datasets without index
+    @return: list of dataset dicts
+    """
+    with open(manifest_path, "r") as f:
+        datasets = yaml.safe_load(f) or []
+    if not isinstance(datasets, list):
+        raise ValueError("replay manifest %s is not a list of datasets" % manifest_path)
+
+    for i, dataset in enumerate(datasets):
+        missing = [key for key in ("file_name", "sourcetype", "source") if not dataset.get(key)]
+        if missing:
+            raise ValueError("dataset %d of replay manifest %s has no %s" % (i, manifest_path, ", ".join(missing)))
+        dataset.setdefault("index", index)
+    return datasets
+
+
+def replay_dataset(host, token, base_dir, dataset, update_timestamp, batch_size, concurrency, compress,
+                   logger, hec_port, session, bucket=None, speed=None):
+    """
+    Replays one dataset of a manifest and measures it.
+    @return: tuple of file name, number of events, bytes, seconds and error message or None
+    """
+    started = time.time()
+    path = os.path.join(base_dir, dataset["file_name"])
+    try:
+        events, sent = replay_file(host, token, path, dataset["index"], dataset["sourcetype"], dataset["source"],
+                                   batch_size, concurrency, compress, logger, hec_port, session,
+                                   dataset.get("update_timestamp", update_timestamp), bucket, speed)
+        return dataset["file_name"], events, sent, time.time() - started, None
+    except Exception as e:
+        logger.error("replay of %s failed: %s" % (dataset["file_name"], str(e)))
+        return dataset["file_name"], 0, 0, time.time() - started, str(e)
+
+
+def replay_manifest(host, password, base_dir, datasets, update_timestamp=False, batch_size=1000,
+                    concurrency=4, compress=False, parallel_files=4, logger=None, username="admin",
+                    splunk_rest_port=8089, hec_port=HEC_PORT, rate=None, speed=None):
+    """
+    Replays the datasets of a manifest into the Splunk server through the HTTP Event Collector. The token is
+    looked up once and parallel_files datasets are replayed at a time over one connection pool. A dataset
+    which fails does not stop the others. Prints the throughput of every dataset and of the whole replay.
+    A rate limit applies to all datasets together, real-time playback to every dataset on its own.
+    @param host: splunk server address
+    @param password: Splunk server password
+    @param base_dir: directory the file names of the datasets are relative to
+    @param datasets: list of dataset dicts as returned by load_manifest
+    @param update_timestamp: shift the timestamps of the datasets to the current time while they are replayed
+    @param batch_size: number of events sent per request
+    @param concurrency: number of concurrent requests per dataset
+    @param compress: gzip compress the requests
+    @param parallel_files: number of datasets replayed in parallel
+    @param logger: logger object
+    @param username: Splunk server username
+    @param splunk_rest_port: Splunk server port
+    @param hec_port: port of the HTTP Event Collector
+    @param rate: maximum number of events per second, unlimited by default
+    @param speed: play the events back in real time multiplied by speed
+    @return: list of tuples of file name, number of events, bytes, seconds and error message or None
+    """
+    started = time.time()
+    bucket = TokenBucket(rate) if rate else None
+    with splunk_sdk.create_session(concurrency * parallel_files, splunk_sdk.EXPORT_RETRIES) as session:
+        token = get_hec_token(host, password, username, splunk_rest_port, session)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=parallel_files) as executor:
+            results = list(executor.map(
+                lambda dataset: replay_dataset(host, token, base_dir, dataset, update_timestamp, batch_size,
+                                               concurrency, compress, logger, hec_port, session, bucket, speed),
+                datasets))
+    elapsed = time.time() - started
+
+    rows = [[file_name, events, sent, "%.1f" % seconds, "%.0f" % (events / seconds if seconds else 0.0),
+             error or "ok"]
+            for file_name, events, sent, seconds, error in results]
+    events = sum(result[1] for result in results)
+    sent = sum(result[2] for result in results)
+    rows.append(["total", events, sent, "%.1f" % elapsed, "%.0f" % (events / elapsed if elapsed else 0.0),
+                 "%d failed" % sum(1 for result in results if result[4])])
+    print(tabulate(rows, headers=["File", "Events", "Bytes", "Seconds", "Events/s", "Status"]))
+    log_achieved_rate(events, elapsed, rate, logger)
+    return results
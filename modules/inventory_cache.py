@@ -0,0 +1,135 @@
+import os
+import json
+import time
+
+
+# public IPs of an attack range are reused by later cli calls until they are older than the TTL or the terraform
+# state of the range changed, changes made in the cloud console are only picked up after the TTL or with --refresh
+INVENTORY_CACHE_TTL = 3600
+INVENTORY_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.attack_range', 'inventory')
+TERRAFORM_DIR = os.path.join(os.path.dirname(__file__), '../terraform')
+
+
+def get_inventory_path(cloud_provider, region, key_name, ar_name):
+    region = ''.join(region.split()).lower()
+    return os.path.join(INVENTORY_CACHE_DIR, '-'.join([cloud_provider, region, key_name, ar_name]) + '.json')
+
+
+def get_state_fingerprint(cloud_provider, ar_name):
+    """
+    get_state_fingerprint function returns the modification time and size of the local terraform state of an attack
+    range, which change with every terraform run that changes the range.
+
+    :param cloud_provider: aws or azure
+    :param ar_name: attack range name
+    :return: list of modification time in nanoseconds and size, or None without a local state
+    """
+    try:
+        stat = os.stat(os.path.join(TERRAFORM_DIR, cloud_provider, 'state', ar_name + '.terraform.tfstate'))
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def read_inventory(cloud_provider, region, key_name, ar_name, ttl=INVENTORY_CACHE_TTL):
+    """
+    read_inventory function returns the cached public IPs of an attack range.
+
+    :param cloud_provider: aws or azure
+    :param region: region or location of the attack range
+    :param key_name: key name of the attack range
+    :param ar_name: attack range name
+    :param ttl: seconds after which the cached inventory is ignored
+    :return: dict of instance name to public IP, or None if there is no valid cache
+    """
+    try:
+        with open(get_inventory_path(cloud_provider, region, key_name, ar_name), 'r') as cache_file:
+            inventory = json.load(cache_file)
+    except (IOError, ValueError):
+        return None
+
+    if time.time() - inventory.get('time', 0) >= ttl:
+        return None
+    if inventory.get('state') != get_state_fingerprint(cloud_provider, ar_name):
+        return None
+    return inventory.get('instances')
+
+
+def write_inventory(cloud_provider, region, key_name, ar_name, instances):
+    os.makedirs(INVENTORY_CACHE_DIR, exist_ok=True)
+    path = get_inventory_path(cloud_provider, region, key_name, ar_name)
+    with open(path + '.tmp', 'w') as cache_file:
+        json.dump({
+            'time': time.time(),
+            'state': get_state_fingerprint(cloud_provider, ar_name),
+            'instances': instances
+        }, cache_file)
+    os.replace(path + '.tmp', path)
+
+
+def clear_inventory(cloud_provider, region, key_name, ar_name):
+    try:
+        os.remove(get_inventory_path(cloud_provider, region, key_name, ar_name))
+    except OSError:
+        pass
+
+
+def get_public_ip(cloud_provider, region, key_name, ar_name, instance_name):
+    instances = read_inventory(cloud_provider, region, key_name, ar_name)
+    if instances:
+        return instances.get(instance_name)
+
+
+def get_state_resources(module):
+    resources = list(module.get('resources', []))
+    for child_module in module.get('child_modules', []):
+        resources.extend(get_state_resources(child_module))
+    return resources
+
+
+def instances_from_terraform_state(state):
+    """
+    instances_from_terraform_state function returns the public IPs of all instances in the output of terraform show -json.
+
+    :param state: parsed output of terraform show -json
+    :return: dict of instance name to public IP
+    """
+    resources = get_state_resources(state.get('values', {}).get('root_module', {}))
+    instances = {}
+
+    # elastic IPs replace the public IP the aws instance got at launch
+    elastic_ips = {}
+    for resource in resources:
+        if resource['type'] == 'aws_eip' and resource['values'].get('instance'):
+            elastic_ips[resource['values']['instance']] = resource['values'].get('public_ip')
+
+    for resource in resources:
+        if resource['type'] == 'aws_instance':
+            values = resource['values']
+            name = (values.get('tags') or {}).get('Name')
+            public_ip = elastic_ips.get(values.get('id')) or values.get('public_ip')
+            if name and public_ip:
+                instances[name] = public_ip
+
+    # azure vms only reference their network interfaces, which reference the public IPs
+    public_ips = {}
+    interface_ips = {}
+    for resource in resources:
+        values = resource['values']
+        if resource['type'] == 'azurerm_public_ip':
+            public_ips[values['id'].lower()] = values.get('ip_address')
+        elif resource['type'] == 'azurerm_network_interface' and values.get('ip_configuration'):
+            ip_id = values['ip_configuration'][0].get('public_ip_address_id')
+            if ip_id:
+                interface_ips[values['id'].lower()] = ip_id.lower()
+
+    for resource in resources:
+        if resource['type'] in ('azurerm_virtual_machine', 'azurerm_linux_virtual_machine', 'azurerm_windows_virtual_machine'):
+            values = resource['values']
+            for interface_id in values.get('network_interface_ids') or []:
+                public_ip = public_ips.get(interface_ips.get(interface_id.lower()))
+                if public_ip:
+                    instances[values['name']] = public_ip
+                    break
+
+    return instances
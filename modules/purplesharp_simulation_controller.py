@@ -16,7 +16,7 @@ class PurplesharpSimulationController(SimulationController):
             ansible_port = 5985
 
         elif self.config['general']['cloud_provider'] == 'azure':
-            target_public_ip = azure_service.get_instance(target, self.config['general']['key_name'], self.config['general']['attack_range_name'])['public_ip']
+            target_public_ip = azure_service.get_instance_public_ip(target, self.config['general']['key_name'], self.config['general']['attack_range_name'], self.config['azure']['location'])
             ansible_user = 'AzureAdmin'
             ansible_port = 5985
 
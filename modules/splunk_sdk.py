@@ -1,17 +1,51 @@
 
+import os
 import sys
+import json
+import gzip
+import math
+import shutil
+import tempfile
+import time
+import concurrent.futures
 from time import sleep
 import splunklib.results as results
 import splunklib.client as client
 import splunklib.results as results
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
+# size of the chunks read from the export response and written to the output file
+EXPORT_CHUNK_SIZE = 1024 * 1024
+# number of retries of a failed export and base delay in seconds of the exponential backoff between them
+EXPORT_RETRIES = 5
+EXPORT_RETRY_BACKOFF = 2
 
-def export_search(host, s, password, export_mode="raw", out=sys.stdout, username="admin", splunk_rest_port=8089):
+
+def create_session(pool_size=10, retries=0):
+    """
+    Creates a requests session whose connection pool is shared by concurrent requests.
+    Only failed connections are retried. A request which reached the server is never sent again, as it may
+    already have taken effect, e.g. a batch sent to the HTTP Event Collector may already be indexed.
+    @param pool_size: maximum number of connections kept open to the Splunk server
+    @param retries: number of retries with exponential backoff of failed connections
+    @return: requests session
+    """
+    session = requests.Session()
+    max_retries = Retry(total=retries, connect=retries, read=0, status=0, other=0,
+                        backoff_factor=EXPORT_RETRY_BACKOFF) if retries else 0
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=max_retries))
+    return session
+
+
+def export_search(host, s, password, export_mode="raw", out=sys.stdout, username="admin", splunk_rest_port=8089,
+                  compress=False, logger=None, session=None, earliest_time=None, latest_time=None):
     """
     Exports events from a search using Splunk REST API to a local file.
     This is faster than performing a search/export from Splunk Python SDK.
+    The response is streamed to the file in chunks, so memory use does not grow with the size of the export.
     @param host: splunk server address
     @param s: search that matches events
     @param password: Splunk server password
@@ -19,13 +53,292 @@ def export_search(host, s, password, export_mode="raw", out=sys.stdout, username
     @param out: local file pointer to write the results
     @param username: Splunk server username
     @param port: Splunk server port
+    @param compress: gzip compress the results while they are written
+    @param logger: logger object reporting the exported bytes and throughput
+    @param session: requests session to reuse pooled connections, a new connection is used by default
+    @param earliest_time: earliest time of the search job, if the search does not set it
+    @param latest_time: latest time of the search job, if the search does not set it
+    @return: number of exported bytes before compression
     """
     import urllib3
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-    r = requests.post("https://%s:%d/servicesNS/admin/search/search/jobs/export" % (host, splunk_rest_port),
-                      auth=(username, password),
-                      data={'output_mode': export_mode,
-                            'search': s,
-                            'max_count': 1000000},
-                      verify=False)
-    out.write(r.text.encode('utf-8'))
\ No newline at end of file
+    started = time.time()
+    exported = 0
+    written = out.tell() if compress else 0
+    data = {'output_mode': export_mode,
+            'search': s,
+            'max_count': 1000000}
+    if earliest_time is not None:
+        data['earliest_time'] = earliest_time
+    if latest_time is not None:
+        data['latest_time'] = latest_time
+    with (session or requests).post("https://%s:%d/servicesNS/admin/search/search/jobs/export" % (host, splunk_rest_port),
+                                    auth=(username, password),
+                                    data=data,
+                                    verify=False,
+                                    stream=True) as r:
+        r.raise_for_status()
+        writer = gzip.GzipFile(fileobj=out, mode='wb') if compress else out
+        for chunk in r.iter_content(chunk_size=EXPORT_CHUNK_SIZE):
+            writer.write(chunk)
+            exported += len(chunk)
+        if compress:
+            writer.close()
+            written = out.tell() - written
+        else:
+            written = exported
+
+    if logger:
+        elapsed = time.time() - started
+        logger.info("exported %d bytes, wrote %d bytes in %.1f seconds (%.1f MB/s)"
+                    % (exported, written, elapsed, exported / 1048576.0 / elapsed if elapsed else 0.0))
+    return exported
+
+
+def get_search_time_range(host, password, earliest, latest, username="admin", splunk_rest_port=8089, session=None):
+    """
+    Resolves Splunk time modifiers like `-2h` or `now` to epoch seconds on the Splunk server, so relative
+    and snapped times mean exactly what they mean in a search.
+    @param host: splunk server address
+    @param password: Splunk server password
+    @param earliest: earliest time modifier
+    @param latest: latest time modifier
+    @param username: Splunk server username
+    @param splunk_rest_port: Splunk server port
+    @param session: requests session to reuse pooled connections
+    @return: tuple of earliest and latest epoch seconds
+    """
+    out = tempfile.TemporaryFile()
+    with out:
+        export_search(host, "| makeresults | addinfo | table info_min_time info_max_time", password,
+                      export_mode="json", out=out, username=username, splunk_rest_port=splunk_rest_port,
+                      session=session, earliest_time=earliest, latest_time=latest)
+        out.seek(0)
+        for line in out:
+            row = json.loads(line).get("result")
+            if row:
+                return float(row["info_min_time"]), float(row["info_max_time"])
+    raise ValueError("Splunk did not resolve the time range earliest=%s latest=%s" % (earliest, latest))
+
+
+def export_slice(host, search, password, start, end, username="admin", splunk_rest_port=8089, session=None,
+                 logger=None, retries=0):
+    """
+    Exports the raw events of one time slice of a search sorted by _time into a temporary file.
+    A slice which fails while it is streamed is exported again after an exponential backoff.
+    @param host: splunk server address
+    @param search: search that matches events, without time modifiers
+    @param password: Splunk server password
+    @param start: earliest epoch second of the slice
+    @param end: latest epoch second of the slice, exclusive
+    @param username: Splunk server username
+    @param splunk_rest_port: Splunk server port
+    @param session: requests session to reuse pooled connections
+    @param logger: logger object
+    @param retries: number of retries of a failed export
+    @return: tuple of temporary file positioned at its start and number of exported bytes
+    """
+    part = tempfile.TemporaryFile()
+    attempt = 0
+    while True:
+        try:
+            part.seek(0)
+            part.truncate()
+            exported = export_search(host, "search %s earliest=%d latest=%d | sort 0 _time" % (search, start, end),
+                                     password, out=part, username=username, splunk_rest_port=splunk_rest_port,
+                                     logger=logger, session=session)
+            part.seek(0)
+            return part, exported
+        except requests.exceptions.RequestException as e:
+            if attempt >= retries:
+                part.close()
+                raise
+            delay = EXPORT_RETRY_BACKOFF * 2 ** attempt
+            attempt += 1
+            if logger:
+                logger.warning("export of slice %d-%d failed: %s, retry %d of %d in %d seconds"
+                               % (start, end, str(e), attempt, retries, delay))
+            sleep(delay)
+
+
+def export_slices(host, search, password, boundaries, username="admin", splunk_rest_port=8089, session=None,
+                  logger=None, retries=0):
+    """
+    Exports consecutive time slices of a search concurrently.
+    @param boundaries: sorted epoch seconds, slice i spans boundaries[i] to boundaries[i + 1]
+    @return: tuple of temporary files in time order and number of exported bytes
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(boundaries) - 1)) as executor:
+        futures = [executor.submit(export_slice, host, search, password, start, end, username, splunk_rest_port,
+                                   session, logger, retries)
+                   for start, end in zip(boundaries[:-1], boundaries[1:])]
+        concurrent.futures.wait(futures)
+
+    slice_parts = [future.result() for future in futures if not future.exception()]
+    if len(slice_parts) < len(futures):
+        for part, exported in slice_parts:
+            part.close()
+        raise next(future.exception() for future in futures if future.exception())
+    return [part for part, exported in slice_parts], sum(exported for part, exported in slice_parts)
+
+
+def write_parts(parts, out, compress=False):
+    """
+    Appends exported slices to the output file and closes them.
+    @param parts: temporary files in time order
+    @param out: local file pointer to write the results
+    @param compress: gzip compress the results while they are written
+    """
+    writer = gzip.GzipFile(fileobj=out, mode='wb') if compress else out
+    for part in parts:
+        with part:
+            shutil.copyfileobj(part, writer, EXPORT_CHUNK_SIZE)
+    if compress:
+        writer.close()
+
+
+def resolve_time_boundaries(earliest_epoch, latest_epoch, slices):
+    """
+    Splits a time range into slices of whole seconds. latest is exclusive, so the range is rounded outwards
+    and no event at its borders is lost.
+    @return: sorted list of epoch seconds
+    """
+    earliest_epoch = int(math.floor(earliest_epoch))
+    latest_epoch = int(math.ceil(latest_epoch))
+    return sorted(set(earliest_epoch + (latest_epoch - earliest_epoch) * i // slices for i in range(slices + 1)))
+
+
+def export_search_slices(host, search, password, earliest, latest, slices, out=sys.stdout, username="admin",
+                         splunk_rest_port=8089, compress=False, logger=None):
+    """
+    Exports the raw events of a search sorted by _time with concurrent exports of equal time slices.
+    Every slice is sorted by Splunk and the slices do not overlap, so writing them in order gives the same
+    result as a single sorted export, without Splunk buffering the whole time range before the first byte.
+    @param host: splunk server address
+    @param search: search that matches events, without time modifiers
+    @param password: Splunk server password
+    @param earliest: earliest time modifier
+    @param latest: latest time modifier
+    @param slices: number of time slices exported concurrently
+    @param out: local file pointer to write the results
+    @param username: Splunk server username
+    @param splunk_rest_port: Splunk server port
+    @param compress: gzip compress the results while they are written
+    @param logger: logger object reporting the exported bytes and throughput
+    @return: number of exported bytes before compression
+    """
+    started = time.time()
+    # not retried by the session, export_slice retries a failed slice as a whole
+    with create_session(slices) as session:
+        earliest_epoch, latest_epoch = get_search_time_range(host, password, earliest, latest, username,
+                                                             splunk_rest_port, session)
+        boundaries = resolve_time_boundaries(earliest_epoch, latest_epoch, slices)
+        parts, exported = export_slices(host, search, password, boundaries, username, splunk_rest_port, session,
+                                        logger, EXPORT_RETRIES)
+    write_parts(parts, out, compress)
+
+    if logger:
+        elapsed = time.time() - started
+        logger.info("exported %d bytes in %d slices in %.1f seconds (%.1f MB/s)"
+                    % (exported, len(parts), elapsed, exported / 1048576.0 / elapsed if elapsed else 0.0))
+    return exported
+
+
+def read_checkpoint(checkpoint_path):
+    """
+    Reads the sidecar checkpoint of an interrupted dump.
+    @param checkpoint_path: path of the checkpoint file
+    @return: checkpoint dict or None
+    """
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r") as f:
+        return json.load(f)
+
+
+def write_checkpoint(checkpoint_path, checkpoint):
+    """
+    Atomically replaces the sidecar checkpoint of a dump.
+    @param checkpoint_path: path of the checkpoint file
+    @param checkpoint: checkpoint dict
+    """
+    with open(checkpoint_path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+
+def export_search_checkpointed(host, search, password, earliest, latest, path, slices=1, checkpoint_interval=3600,
+                               username="admin", splunk_rest_port=8089, compress=False, logger=None):
+    """
+    Exports the raw events of a search sorted by _time into a file in time slices of checkpoint_interval seconds.
+    After every batch of slices is written, the last fully written _time boundary and the file size are
+    recorded in the sidecar file <path>.checkpoint. When the same dump is started again after a failure, the
+    file is truncated to the checkpoint and the export resumes from its boundary. The time modifiers are resolved
+    to epoch seconds first, a checkpoint of another search, time range, slices or compression is ignored and the
+    dump starts over. So a relative time range like -24h is only resumed while it resolves to the same range,
+    e.g. -24h@h within the same hour. The sidecar file is removed when the dump is complete.
+    @param host: splunk server address
+    @param search: search that matches events, without time modifiers
+    @param password: Splunk server password
+    @param earliest: earliest time modifier
+    @param latest: latest time modifier
+    @param path: path of the dump file
+    @param slices: number of time slices exported concurrently
+    @param checkpoint_interval: length of a time slice in seconds
+    @param username: Splunk server username
+    @param splunk_rest_port: Splunk server port
+    @param compress: gzip compress every batch of slices as gzip member while it is written
+    @param logger: logger object reporting progress and throughput
+    @return: number of exported bytes before compression
+    """
+    started = time.time()
+    checkpoint_path = path + ".checkpoint"
+    exported = 0
+
+    # not retried by the session, export_slice retries a failed slice as a whole
+    with create_session(slices) as session:
+        # a checkpoint is only resumed by a dump of the same absolute time range, relative time modifiers like
+        # -24h resolve to another range later on
+        earliest_epoch, latest_epoch = get_search_time_range(host, password, earliest, latest, username,
+                                                             splunk_rest_port, session)
+        boundaries = resolve_time_boundaries(earliest_epoch, latest_epoch, 1)
+        request = {"search": search, "earliest": boundaries[0], "latest": boundaries[-1], "slices": slices,
+                   "compress": compress}
+        checkpoint = read_checkpoint(checkpoint_path)
+        if checkpoint and not (all(checkpoint.get(key) == value for key, value in request.items())
+                               and os.path.exists(path) and os.path.getsize(path) >= checkpoint["offset"]):
+            if logger:
+                logger.info("checkpoint %s belongs to another dump or time range, starting over" % checkpoint_path)
+            checkpoint = None
+
+        if checkpoint:
+            if logger:
+                logger.info("resuming dump %s from checkpoint at _time %d" % (path, checkpoint["boundary"]))
+        else:
+            checkpoint = dict(request, boundary=boundaries[0], offset=0)
+
+        boundaries = list(range(checkpoint["boundary"], checkpoint["latest"], checkpoint_interval)) \
+            + [checkpoint["latest"]]
+        with open(path, "r+b" if checkpoint["offset"] else "wb") as out:
+            out.truncate(checkpoint["offset"])
+            out.seek(checkpoint["offset"])
+            for i in range(0, len(boundaries) - 1, slices):
+                batch = boundaries[i:i + slices + 1]
+                parts, batch_exported = export_slices(host, search, password, batch, username, splunk_rest_port,
+                                                      session, logger, EXPORT_RETRIES)
+                write_parts(parts, out, compress)
+                out.flush()
+                os.fsync(out.fileno())
+                exported += batch_exported
+
+                checkpoint["boundary"] = batch[-1]
+                checkpoint["offset"] = out.tell()
+                write_checkpoint(checkpoint_path, checkpoint)
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    if logger:
+        elapsed = time.time() - started
+        logger.info("exported %d bytes in %.1f seconds (%.1f MB/s)"
+                    % (exported, elapsed, exported / 1048576.0 / elapsed if elapsed else 0.0))
+    return exported
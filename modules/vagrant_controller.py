@@ -6,7 +6,8 @@ import vagrant
 
 from tabulate import tabulate
 from jinja2 import Environment, FileSystemLoader
-from modules import splunk_sdk
+from modules import splunk_sdk, hec_replay, art_cache
+from modules.DataManipulation import DataManipulation
 
 from modules.attack_range_controller import AttackRangeController
 from modules.art_simulation_controller import ArtSimulationController
@@ -21,6 +22,13 @@ class VagrantController(AttackRangeController):
     def build(self) -> None:
 
         self.logger.info("[action] > build\n")
+        if self.config['simulation']['atomic_red_team_cache'] == '1':
+            self.config['simulation']['atomic_red_team_archive'] = art_cache.get_atomics_archive(
+                self.config['simulation']['atomic_red_team_repo'],
+                self.config['simulation']['atomic_red_team_branch'],
+                self.logger,
+            )
+
         vagrantfile = 'Vagrant.configure("2") do |config| \n \n'
 
         if self.config['phantom_server']['phantom_server'] == "1":
@@ -81,24 +89,26 @@ class VagrantController(AttackRangeController):
         v1.destroy()
         self.logger.info("attack_range has been destroy using vagrant successfully")
 
-    def stop(self, instance_ids) -> None:
+    def stop(self, instance_ids=None, wait=False) -> None:
         self.logger.info("[action] > stop\n")
         v1 = vagrant.Vagrant('vagrant/', quiet_stdout=False)
-        v1.halt()
+        for vm_name in instance_ids or [None]:
+            v1.halt(vm_name=vm_name)
 
-    def resume(self, instance_ids) -> None:
+    def resume(self, instance_ids=None, wait=False) -> None:
         self.logger.info("[action] > resume\n")
         v1 = vagrant.Vagrant('vagrant/', quiet_stdout=False)
-        v1.up()
+        for vm_name in instance_ids or [None]:
+            v1.up(vm_name=vm_name)
 
     def packer(self, image_name) -> None:
         pass
 
-    def simulate(self, engine, target, technique, playbook) -> None:
+    def simulate(self, engine, target, technique, playbook, host_concurrency=1) -> None:
         self.logger.info("[action] > simulate\n")
         if engine == "ART":
             simulation_controller = ArtSimulationController(self.config)
-            simulation_controller.simulate(target, technique)
+            simulation_controller.simulate(target, technique, host_concurrency)
         if engine == "PurpleSharp":
             simulation_controller = PurplesharpSimulationController(self.config)
             simulation_controller.simulate(target, technique, playbook)
@@ -133,20 +143,68 @@ class VagrantController(AttackRangeController):
             print(msg)
 
 
-    def dump(self, dump_name, search, earliest, latest) -> None:
+    def dump(self, dump_name, search, earliest, latest, compress=False, slices=1, checkpoint=False,
+             checkpoint_interval=3600) -> None:
         self.logger.info("Dump log data")
         dump_search = "search " + search + " earliest=-" + earliest + " latest=" + latest + " | sort 0 _time"
         self.logger.info("Dumping Splunk Search: " + dump_search)
-        out = open(os.path.join(os.path.dirname(__file__), "../" + dump_name), 'wb')
-
-        splunk_sdk.export_search('localhost',
-                                    s=dump_search,
-                                    password=self.config['general']['attack_range_password'],
-                                    out=out)
-        out.close()
+        dump_path = os.path.join(os.path.dirname(__file__), "../" + dump_name)
+
+        if checkpoint:
+            splunk_sdk.export_search_checkpointed('localhost',
+                                                  search,
+                                                  self.config['general']['attack_range_password'],
+                                                  '-' + earliest,
+                                                  latest,
+                                                  dump_path,
+                                                  slices=slices,
+                                                  checkpoint_interval=checkpoint_interval,
+                                                  compress=compress,
+                                                  logger=self.logger)
+        elif slices > 1:
+            out = open(dump_path, 'wb')
+            splunk_sdk.export_search_slices('localhost',
+                                            search,
+                                            self.config['general']['attack_range_password'],
+                                            '-' + earliest,
+                                            latest,
+                                            slices,
+                                            out=out,
+                                            compress=compress,
+                                            logger=self.logger)
+            out.close()
+        else:
+            out = open(dump_path, 'wb')
+            splunk_sdk.export_search('localhost',
+                                        s=dump_search,
+                                        password=self.config['general']['attack_range_password'],
+                                        out=out,
+                                        compress=compress,
+                                        logger=self.logger)
+            out.close()
         self.logger.info("[Completed]")
 
-    def replay(self, file_name, index, sourcetype, source) -> None:
+    def replay(self, file_name, index, sourcetype, source, update_timestamp=False, workers=1, engine='oneshot',
+               batch_size=1000, concurrency=4, compress=False, rate=None, speed=None) -> None:
+        if update_timestamp and engine != 'hec':
+            DataManipulation().manipulate_timestamp(os.path.join(os.path.dirname(__file__), "../" + file_name), self.logger, sourcetype, source, workers)
+
+        if engine == 'hec':
+            hec_replay.replay('localhost',
+                              self.config['general']['attack_range_password'],
+                              os.path.join(os.path.dirname(__file__), "../" + file_name),
+                              index,
+                              sourcetype,
+                              source,
+                              batch_size=batch_size,
+                              concurrency=concurrency,
+                              compress=compress,
+                              logger=self.logger,
+                              update_timestamp=update_timestamp,
+                              rate=rate,
+                              speed=speed)
+            return
+
         ansible_vars = {}
         ansible_vars['file_name'] = file_name
         ansible_vars['ansible_user'] = 'vagrant'
@@ -164,6 +222,9 @@ class VagrantController(AttackRangeController):
                                     playbook=os.path.join(os.path.dirname(__file__), 'ansible/data_replay.yml'),
                                     extravars=ansible_vars)
 
+    def get_splunk_ip(self) -> str:
+        return 'localhost'
+
     def create_remote_backend(self, backend_name) -> None:
         self.logger.error("Command not supported with local provider.")
         sys.exit(1)
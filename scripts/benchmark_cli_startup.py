@@ -0,0 +1,176 @@
+import os
+import re
+import sys
+import time
+import runpy
+import types
+import argparse
+import tempfile
+import subprocess
+import importlib
+import importlib.abc
+import importlib.machinery
+
+SCRIPT = os.path.abspath(__file__)
+REPOSITORY = os.path.abspath(os.path.join(os.path.dirname(SCRIPT), ".."))
+PROVIDERS = ["aws", "azure", "local"]
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+# the sdk modules each provider imports for its api calls, the calls themselves are replaced by stubs
+PROVIDER_SDKS = {
+    "aws": ["boto3"],
+    "azure": ["azure.identity", "azure.mgmt.compute", "azure.mgmt.network", "azure.mgmt.resource"],
+}
+
+
+def stub_aws_service(module):
+    def check_region(config_region):
+        import_sdks("aws")
+        return True
+
+    def get_all_instances(key_name, ar_name, region):
+        import_sdks("aws")
+        return []
+
+    module.check_region = check_region
+    module.get_all_instances = get_all_instances
+
+
+def stub_azure_service(module):
+    def get_all_instances(key_name, ar_name):
+        import_sdks("azure")
+        return []
+
+    module.get_all_instances = get_all_instances
+
+
+def stub_vagrant_controller(module):
+    status = types.SimpleNamespace(status=lambda: [])
+    module.vagrant = types.SimpleNamespace(Vagrant=lambda *args, **kwargs: status)
+
+
+# stubs applied right after a module is executed, so the baseline tree with its imports at the top is patched the same
+STUBS = {
+    "modules.aws_service": stub_aws_service,
+    "modules.azure_service": stub_azure_service,
+    "modules.vagrant_controller": stub_vagrant_controller,
+}
+
+
+def import_sdks(provider):
+    # an import statement and not importlib.import_module, only the former is reported by -X importtime
+    for module_name in PROVIDER_SDKS[provider]:
+        __import__(module_name)
+
+
+class StubFinder(importlib.abc.MetaPathFinder):
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in STUBS:
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+        if spec is None:
+            return None
+        exec_module = spec.loader.exec_module
+
+        def exec_stubbed_module(module):
+            exec_module(module)
+            STUBS[fullname](module)
+
+        spec.loader.exec_module = exec_stubbed_module
+        return spec
+
+
+def child(repository, action_args):
+    # runs attack_range.py of a tree with the cloud api calls stubbed
+    sys.path.insert(0, repository)
+    os.chdir(repository)
+    sys.meta_path.insert(0, StubFinder())
+    sys.argv = [os.path.join(repository, "attack_range.py")] + action_args
+    runpy.run_path(sys.argv[0], run_name="__main__")
+
+
+def write_config(directory, provider):
+    path = os.path.join(directory, "benchmark_" + provider + ".yml")
+    with open(path, "w") as f:
+        f.write("general:\n"
+                "  attack_range_password: \"Benchmark-0nly\"\n"
+                "  cloud_provider: \"" + provider + "\"\n"
+                "azure:\n"
+                "  subscription_id: \"00000000-0000-0000-0000-000000000000\"\n")
+    return path
+
+
+def run(repository, action_args):
+    # returns the seconds to the first output and to exit, the exit code with the last error line and the
+    # cumulative microseconds of the top level imports
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-X", "importtime", SCRIPT, "--child", repository, "--"] + action_args,
+                               cwd=repository, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process.stdout.read(1)
+    first_output = time.perf_counter() - started
+    stdout, stderr = process.communicate()
+    finished = time.perf_counter() - started
+
+    imports = []
+    error = ""
+    for line in stderr.decode("utf-8", "replace").splitlines():
+        match = IMPORT_TIME.match(line)
+        # only the imports at the first nesting level, their time includes everything they import
+        if match and len(match.group(3)) == 1:
+            imports.append((int(match.group(2)), match.group(4)))
+        elif not match and line.strip():
+            error = line.strip()
+    status = "" if process.returncode == 0 else "  (exit code %d: %s)" % (process.returncode, error)
+    return first_output, finished, status, imports
+
+
+def export_tree(revision, directory):
+    # the baseline is a clean checkout of the revision, the working tree is left alone
+    archive = subprocess.run(["git", "-C", REPOSITORY, "archive", revision], check=True, stdout=subprocess.PIPE)
+    subprocess.run(["tar", "-x", "-C", directory], input=archive.stdout, check=True)
+    return directory
+
+
+def main(args):
+    if args[:1] == ["--child"]:
+        return child(args[1], args[3:])
+
+    parser = argparse.ArgumentParser(
+        description="startup benchmark of attack_range.py. Runs -h and the show action against a stub config of "
+                    "every cloud provider with the cloud api calls stubbed, so the time includes loading the "
+                    "controller and the sdk of the provider")
+    parser.add_argument("--providers", type=str, default=",".join(PROVIDERS),
+                        help="comma separated list of cloud providers to run show with")
+    parser.add_argument("--baseline", type=str,
+                        help="git revision to compare with, e.g. the commit before the lazy loading")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="number of runs per command, the fastest run is reported")
+    parser.add_argument("--top", type=int, default=5,
+                        help="number of slowest top level imports listed per command")
+    args = parser.parse_args(args)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        trees = [("current", REPOSITORY)]
+        if args.baseline:
+            baseline_dir = os.path.join(tmp_dir, "baseline")
+            os.makedirs(baseline_dir)
+            trees.append((args.baseline, export_tree(args.baseline, baseline_dir)))
+
+        commands = [("-h", ["-h"])]
+        for provider in [provider.strip() for provider in args.providers.split(",")]:
+            commands.append(("show " + provider, ["-c", write_config(tmp_dir, provider), "show"]))
+
+        for name, action_args in commands:
+            for tree, repository in trees:
+                first_output, finished, status, imports = min(
+                    (run(repository, action_args) for i in range(args.runs)), key=lambda result: result[1])
+                print("%-12s %-10s first output: %6.3fs  exit: %6.3fs  imports: %6.3fs%s"
+                      % (name, tree, first_output, finished, sum(cumulative for cumulative, module in imports) / 1e6,
+                         status))
+                for cumulative, module in sorted(imports, reverse=True)[:args.top]:
+                    print("%25s %6.3fs  %s" % ("", cumulative / 1e6, module))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
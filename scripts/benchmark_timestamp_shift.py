@@ -0,0 +1,65 @@
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../modules"))
+from DataManipulation import TimestampCodec, shift_timestamp_with_codecs
+
+FORMATS = {
+    "cloudtrail": ("%Y-%m-%dT%H:%M:%S.%fZ", r'"eventTime": "([^"]+)"', '{"eventTime": "%s", "eventName": "ConsoleLogin"}\n'),
+    "exchange": ("%Y-%m-%dT%H:%M:%S", r'"CreationTime": "([^"]+)"', '{"CreationTime": "%s", "Operation": "New-InboxRule"}\n'),
+    "windows": ("%m/%d/%Y %I:%M:%S %p", r'(\d{2}/\d{2}/\d{4} \d{2}:\d{2}:\d{2} [AP]M)', '%s\nLogName=Security\n'),
+}
+
+
+def generate_file(path, fmt, template, lines):
+    start = datetime(2022, 3, 4, 10, 0, 0)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(lines):
+            f.write(template % (start + timedelta(seconds=i, microseconds=i * 7919 % 1000000)).strftime(fmt))
+
+
+def baseline_shift(timestamp, fmt, difference):
+    return (difference + datetime.strptime(timestamp, fmt)).strftime(fmt)
+
+
+def run(path, regex, shift):
+    pattern = re.compile(regex)
+    started = time.perf_counter()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            match = pattern.search(line)
+            if match:
+                line.replace(match.group(1), shift(match.group(1)))
+    return time.perf_counter() - started
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="micro-benchmark of the timestamp codec against datetime.strptime/strftime")
+    parser.add_argument("--lines", type=int, default=1000000,
+                        help="number of events in the generated file")
+    args = parser.parse_args(args)
+
+    difference = timedelta(days=1234, seconds=5678, microseconds=91011)
+    delta = difference // timedelta(microseconds=1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, (fmt, regex, template) in FORMATS.items():
+            path = os.path.join(tmp_dir, name + ".log")
+            generate_file(path, fmt, template, args.lines)
+            codecs = [TimestampCodec.for_format(fmt)]
+
+            baseline = run(path, regex, lambda timestamp: baseline_shift(timestamp, fmt, difference))
+            codec = run(path, regex, lambda timestamp: shift_timestamp_with_codecs(codecs, timestamp, delta))
+            print("%-10s %d lines  strptime: %6.2fs  codec: %6.2fs  speedup: %.1fx"
+                  % (name, args.lines, baseline, codec, baseline / codec))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -84,6 +84,13 @@ resource "aws_security_group" "default" {
     cidr_blocks = split(",", var.general.ip_whitelist)
   }
 
+  ingress {
+    from_port   = 8088
+    to_port     = 8088
+    protocol    = "tcp"
+    cidr_blocks = split(",", var.general.ip_whitelist)
+  }
+
   ingress {
     from_port   = 5986
     to_port     = 5986
@@ -59,6 +59,18 @@ resource "azurerm_network_security_group" "attackrange-nsg" {
     destination_address_prefix = "*"
   }
 
+  security_rule {
+    name                       = "Splunk_8088"
+    priority                   = 1006
+    direction                  = "Inbound"
+    access                     = "Allow"
+    protocol                   = "Tcp"
+    source_port_range          = "*"
+    destination_port_range     = "8088"
+    source_address_prefixes    = [var.general.ip_whitelist]
+    destination_address_prefix = "*"
+  }
+
   # RDP
   security_rule {
     name                       = "RDP"
@@ -0,0 +1,199 @@
+import os
+import sys
+import gzip
+import logging
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from datetime import datetime, timedelta
+
+from modules.DataManipulation import (DataManipulation, TIMESTAMP_SHIFTERS, TimestampCodec, IsoTimestampCodec,
+                                      UsTimestampCodec, EpochTimestampCodec, find_timestamp_shifter)
+
+
+CLOUDTRAIL_EVENTS = (
+    b'{"eventVersion":"1.08","eventTime":"2021-01-02T03:04:05Z","eventName":"ListBuckets"}\n'
+    b'{"eventVersion":"1.08","eventTime":"garbage","eventName":"GetObject"}\n'
+    b'{"eventVersion":"1.08","eventTime":"2021-01-02T03:04:00Z","eventName":"PutObject"}\n'
+)
+
+
+@pytest.mark.parametrize("validate_json", [False, True])
+def test_cloudtrail_malformed_timestamp_is_logged_and_kept(tmp_path, caplog, validate_json):
+    path = tmp_path / "cloudtrail.json"
+    path.write_bytes(CLOUDTRAIL_EVENTS)
+    logger = logging.getLogger('test_data_manipulation')
+
+    with caplog.at_level(logging.ERROR, logger=logger.name):
+        DataManipulation().manipulate_timestamp(str(path), logger, 'aws:cloudtrail', 'cloudtrail',
+                                                validate_json=validate_json)
+
+    lines = path.read_bytes().splitlines(keepends=True)
+    original = CLOUDTRAIL_EVENTS.splitlines(keepends=True)
+    assert len(lines) == 3
+    assert lines[1] == original[1]
+    assert lines[0] != original[0] and lines[2] != original[2]
+    assert any("Error in timestamp replacement occured" in record.message for record in caplog.records)
+
+
+def test_cloudtrail_shifts_latest_event_to_now(tmp_path):
+    path = tmp_path / "cloudtrail.json"
+    path.write_bytes(CLOUDTRAIL_EVENTS)
+    data_manipulation = DataManipulation()
+
+    assert data_manipulation.compute_difference(str(path), TIMESTAMP_SHIFTERS['cloudtrail'],
+                                                logging.getLogger('test_data_manipulation'))
+    data_manipulation.rewrite_file(str(path), 'cloudtrail', logging.getLogger('test_data_manipulation'))
+
+    assert b'"eventTime":"2021-01-02T03:04:05Z"' not in path.read_bytes()
+
+
+def test_gzip_dump_is_shifted_and_compressed_again(tmp_path, caplog):
+    path = tmp_path / "cloudtrail.json.gz"
+    path.write_bytes(gzip.compress(CLOUDTRAIL_EVENTS))
+    logger = logging.getLogger('test_data_manipulation')
+
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        DataManipulation().manipulate_timestamp(str(path), logger, 'aws:cloudtrail', 'cloudtrail')
+
+    lines = gzip.decompress(path.read_bytes()).splitlines(keepends=True)
+    original = CLOUDTRAIL_EVENTS.splitlines(keepends=True)
+    assert len(lines) == 3
+    assert lines[0] != original[0] and lines[2] != original[2]
+    assert any("timestamp cache: 0 hits, 3 misses" in record.message for record in caplog.records)
+    assert [p.name for p in tmp_path.iterdir()] == ["cloudtrail.json.gz"]
+
+
+def micros_since_year_one(value):
+    return (value - datetime(1, 1, 1)) // timedelta(microseconds=1)
+
+
+@pytest.mark.parametrize("codec, timestamp, expected", [
+    (TimestampCodec.for_format("%Y-%m-%dT%H:%M:%S.%fZ"), "2021-01-02T03:04:05.123456Z",
+     datetime(2021, 1, 2, 3, 4, 5, 123456)),
+    (TimestampCodec.for_format("%Y-%m-%dT%H:%M:%SZ"), "2020-02-29T23:59:59Z", datetime(2020, 2, 29, 23, 59, 59)),
+    (TimestampCodec.for_format("%Y-%m-%dT%H:%M:%S"), "1999-12-31T00:00:00", datetime(1999, 12, 31)),
+    (IsoTimestampCodec("%Y-%m-%d %H:%M:%S.%f", fraction=3, separator=' '), "2021-06-30 12:34:56.789",
+     datetime(2021, 6, 30, 12, 34, 56, 789000)),
+    (TimestampCodec.for_format("%m/%d/%Y %I:%M:%S %p"), "01/02/2021 12:00:01 AM", datetime(2021, 1, 2, 0, 0, 1)),
+    (TimestampCodec.for_format("%m/%d/%Y %I:%M:%S %p"), "01/02/2021 12:30:00 PM", datetime(2021, 1, 2, 12, 30)),
+    (TimestampCodec.for_format("%m/%d/%Y %I:%M:%S %p"), "12/31/2021 11:59:59 PM", datetime(2021, 12, 31, 23, 59, 59)),
+    (EpochTimestampCodec(fraction=3), "1609556645.123", datetime(2021, 1, 2, 3, 4, 5, 123000)),
+    (EpochTimestampCodec(fraction=6), "1609556645.000001", datetime(2021, 1, 2, 3, 4, 5, 1)),
+])
+def test_codec_round_trip(codec, timestamp, expected):
+    micros = codec.parse(timestamp)
+
+    assert micros == micros_since_year_one(expected)
+    assert codec.format(micros) == timestamp
+    assert codec.shift(timestamp, 0) == timestamp
+
+
+def test_fixed_codecs_are_chosen_for_their_formats():
+    assert type(TimestampCodec.for_format("%Y-%m-%dT%H:%M:%S.%fZ")) is IsoTimestampCodec
+    assert type(TimestampCodec.for_format("%m/%d/%Y %I:%M:%S %p")) is UsTimestampCodec
+    assert type(TimestampCodec.for_format("%d.%m.%Y %H:%M")) is TimestampCodec
+
+
+@pytest.mark.parametrize("codec, timestamp, delta, expected", [
+    (TimestampCodec.for_format("%Y-%m-%dT%H:%M:%SZ"), "2021-12-31T23:59:59Z", 1, "2022-01-01T00:00:00Z"),
+    (TimestampCodec.for_format("%m/%d/%Y %I:%M:%S %p"), "02/28/2024 11:59:59 PM", 1, "02/29/2024 12:00:00 AM"),
+    (TimestampCodec.for_format("%m/%d/%Y %I:%M:%S %p"), "03/01/2021 11:59:59 AM", 1, "03/01/2021 12:00:00 PM"),
+    (EpochTimestampCodec(fraction=3), "1609556645.999", 0.001, "1609556646.000"),
+    (TimestampCodec("%d.%m.%Y %H:%M"), "31.12.2021 23:59", 60, "01.01.2022 00:00"),
+])
+def test_codec_shift_matches_datetime(codec, timestamp, delta, expected):
+    assert codec.shift(timestamp, int(delta * 1000000)) == expected
+
+
+def test_iso_codec_keeps_digits_below_a_microsecond():
+    codec = IsoTimestampCodec("%Y-%m-%dT%H:%M:%S.%fZ", fraction=7, suffix='Z')
+
+    assert codec.shift("2021-01-02T03:04:05.1234567Z", 86400 * 1000000) == "2021-01-03T03:04:05.1234567Z"
+
+
+@pytest.mark.parametrize("codec, timestamp", [
+    (TimestampCodec.for_format("%Y-%m-%dT%H:%M:%SZ"), "2021-02-30T00:00:00Z"),
+    (TimestampCodec.for_format("%m/%d/%Y %I:%M:%S %p"), "13/01/2021 01:00:00 AM"),
+    (EpochTimestampCodec(fraction=3), "1609556645"),
+])
+def test_codec_rejects_malformed_timestamps(codec, timestamp):
+    assert codec.parse_fixed(timestamp) is None
+    with pytest.raises(ValueError):
+        codec.parse(timestamp)
+
+
+WINDOWS_EVENTS = b''.join(
+    b'%02d/%02d/2021 %02d:%02d:%02d %s\r\nLogName=Security\r\nEventCode=%d\r\nMessage=An account was logged on.\r\n'
+    % (1 + i // 2000 % 12, 1 + i // 100 % 28, 1 + i // 60 % 12, i % 60, i * 7 % 60, b'AM' if i % 3 else b'PM', 4624 + i)
+    for i in range(3000))
+
+
+@pytest.mark.parametrize("shifter_name, content, validate_json", [
+    ('windows', WINDOWS_EVENTS, False),
+    ('cloudtrail', CLOUDTRAIL_EVENTS * 1000, False),
+    ('cloudtrail', CLOUDTRAIL_EVENTS * 1000, True),
+])
+def test_parallel_rewrite_is_byte_identical_to_serial(tmp_path, shifter_name, content, validate_json):
+    logger = logging.getLogger('test_data_manipulation')
+    outputs = []
+    for workers in (1, 4):
+        path = tmp_path / ("dump-%d.log" % workers)
+        path.write_bytes(content)
+        data_manipulation = DataManipulation()
+        data_manipulation.difference = timedelta(days=400, seconds=12345)
+        data_manipulation.validate_json = validate_json
+        data_manipulation.rewrite_file(str(path), shifter_name, logger, workers)
+        outputs.append(path.read_bytes())
+
+    assert len(DataManipulation().split_file(str(tmp_path / "dump-4.log"), 4)) == 4
+    assert outputs[0] != content
+    assert outputs[0] == outputs[1]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["dump-1.log", "dump-4.log"]
+
+
+@pytest.mark.parametrize("sourcetype, source, shifter_name", [
+    ('aws:cloudtrail', 'aws_cloudtrail', 'cloudtrail'),
+    ('ms:o365:management', 'exchange', 'exchange'),
+    ('WinEventLog', 'WinEventLog:Security', 'windows'),
+    ('custom', 'WinEventLog:System', 'windows'),
+    ('XmlWinEventLog', 'XmlWinEventLog:Microsoft-Windows-Sysmon/Operational', 'xmlwineventlog'),
+    ('linux:audit', 'audit', 'linux_audit'),
+    ('bro:conn:json', 'zeek', 'zeek'),
+    ('zeek:dns:json', 'zeek', 'zeek'),
+    ('OktaIM2:log', 'okta', 'okta'),
+])
+def test_shifter_is_found_by_sourcetype_or_source(sourcetype, source, shifter_name):
+    assert find_timestamp_shifter(sourcetype, source) is TIMESTAMP_SHIFTERS[shifter_name]
+
+
+def test_unknown_sourcetype_keeps_timestamps(tmp_path, caplog):
+    path = tmp_path / "custom.log"
+    path.write_bytes(CLOUDTRAIL_EVENTS)
+    logger = logging.getLogger('test_data_manipulation')
+
+    assert find_timestamp_shifter('custom:sourcetype', 'custom') is None
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        DataManipulation().manipulate_timestamp(str(path), logger, 'custom:sourcetype', 'custom')
+
+    assert path.read_bytes() == CLOUDTRAIL_EVENTS
+    assert any("no timestamp shifter registered" in record.message for record in caplog.records)
+
+
+@pytest.mark.parametrize("sourcetype, source, line", [
+    ('linux:audit', 'audit', b'type=SYSCALL msg=audit(1609556645.123:42): arch=c000003e syscall=59\n'),
+    ('bro:conn:json', 'zeek', b'{"ts":1609556645.123456,"uid":"C1"}\n'),
+    ('OktaIM2:log', 'okta', b'{"published":"2021-01-02T03:04:05.123Z","eventType":"user.session.start"}\n'),
+    ('XmlWinEventLog', 'XmlWinEventLog:Security', b"<TimeCreated SystemTime='2021-01-02T03:04:05.1234567Z'/>\n"),
+])
+def test_registered_shifter_moves_latest_event_to_now(tmp_path, sourcetype, source, line):
+    path = tmp_path / "dump.log"
+    path.write_bytes(line)
+
+    DataManipulation().manipulate_timestamp(str(path), logging.getLogger('test_data_manipulation'), sourcetype,
+                                            source)
+
+    assert path.read_bytes() != line
+    assert b'2021' not in path.read_bytes() and b'16095566' not in path.read_bytes()